@@ -1,9 +1,11 @@
 from .base import AuthError
 
 from . import bitwarden
+from . import bitwarden_serve
 
 BACKENDS = {
         'bitwarden': bitwarden.BitWardenAuthSource,
+        'bitwarden_serve': bitwarden_serve.BitWardenServeAuthSource,
         }
 
 def get_backend(name):
@@ -2,6 +2,9 @@ class AuthSource:
     def get_auth_info(self, item_id):
         raise NotImplementedError
 
+    def get_auth_infos(self, item_ids):
+        return [ self.get_auth_info(i) for i in item_ids ]
+
     def unlock(self, password):
         pass
 
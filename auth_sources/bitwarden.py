@@ -1,30 +1,153 @@
 import subprocess
 import os
 import json
+import time
+import hmac
+import hashlib
+import threading
 
 from .base import AuthSource, AuthError
 
+# Seconds an unlocked vault and the items read from it are kept in memory, so that fetches that follow each other
+# don't run bw again. 0 disables the cache.
+DEFAULT_CACHE_TTL = 300
+
+def _hash_password(password, salt):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000)
+
+
+class _UnlockedVault:
+    """
+    A session key of an unlocked vault and the items read with it. The password is only kept as a salted hash,
+    to check that later unlocks use the same one.
+    """
+    def __init__(self, password, sessionkey, ttl):
+        self._salt = os.urandom(16)
+        self._password_hash = _hash_password(password, self._salt)
+        self.sessionkey = sessionkey
+        self.items = {}
+        self.expires = time.monotonic() + ttl
+        # Auth sources currently unlocked with this vault
+        self.users = 0
+
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def matches(self, password):
+        return not self.expired() and hmac.compare_digest(self._password_hash, _hash_password(password, self._salt))
+
+
+_vaults = {}
+_vaults_lock = threading.Lock()
+# A lock per cached vault key, held while its vault is looked up, unlocked, released or locked
+_key_locks = {}
+
+def _key_lock(key):
+    with _vaults_lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
 class BitWardenAuthSource(AuthSource):
-    def __init__(self, path='/usr/local/bin:/usr/bin', cmd='bw'):
+    def __init__(self, path='/usr/local/bin:/usr/bin', cmd='bw', cache_ttl=DEFAULT_CACHE_TTL):
         self._cmd = cmd
         self.sessionkey = None
         self._environ_base = dict(PATH=path, HOME=os.environ['HOME'])
+        self._cache_key = (cmd, path, os.environ['HOME'])
+        self._cache_ttl = cache_ttl
+        self._vault = None
 
     def _run_bw(self, *args, environ={}):
         return subprocess.run((self._cmd,) + args, shell=False, stdin=subprocess.DEVNULL, capture_output=True, env={ **self._environ_base, **environ }, text=True)
 
-    def get_auth_info(self, item_id):
-        item = self.get_item(item_id)
+    @staticmethod
+    def _auth_info(item_id, item):
+        if item is None:
+            raise AuthError(f"bw item not found: {item_id}", info=None)
         return dict(username=item['login']['username'], password=item['login']['password'])
 
+    def get_auth_info(self, item_id):
+        return self._auth_info(item_id, self.get_item(item_id))
+
+    def get_auth_infos(self, item_ids):
+        """
+        Like get_auth_info for several items. Items that aren't cached are read with a single bw call.
+        """
+        cached = self._vault.items if self._vault else {}
+        missing = { i for i in item_ids if i not in cached }
+        if len(missing) > 1:
+            items = { item['id']: item for item in self._list_items() }
+            cached.update({ i: items[i] for i in missing if i in items })
+            return [ self._auth_info(i, cached.get(i)) for i in item_ids ]
+        return [ self.get_auth_info(i) for i in item_ids ]
+
     def unlock(self, password):
-        if self.sessionkey is None:
-            self.sessionkey = self.bw("unlock", "--passwordenv", "BW_PASS", "--raw", environ=dict(BW_PASS=password))
+        if self.sessionkey is not None:
+            return self
+        if not self._cache_ttl:
+            self.sessionkey = self._unlock(password)
+            return self
+        with _key_lock(self._cache_key):
+            vault = _vaults.get(self._cache_key)
+            if vault is None or not vault.matches(password):
+                vault = _UnlockedVault(password, self._unlock(password), self._cache_ttl)
+                _vaults[self._cache_key] = vault
+                timer = threading.Timer(self._cache_ttl, self._expire, args=(vault,))
+                timer.daemon = True
+                timer.start()
+            vault.users += 1
+        self._vault = vault
+        self.sessionkey = vault.sessionkey
         return self
-        
+
+    def _expire(self, vault):
+        with _key_lock(self._cache_key):
+            vault.expires = min(vault.expires, time.monotonic())
+            self._lock_if_unused(vault)
+
+    def _lock_if_unused(self, vault):
+        # Called with the key lock held. A vault that's still in use is locked by the last auth source to release it.
+        if _vaults.get(self._cache_key) is not vault or vault.users or not vault.expired():
+            return
+        del _vaults[self._cache_key]
+        vault.items.clear()
+        try:
+            self._lock()
+        except AuthError:
+            pass
+
     def lock(self):
-        self.bw("lock")
+        # A cached vault stays unlocked until it expires
+        if self._vault is None:
+            self._lock()
+        else:
+            with _key_lock(self._cache_key):
+                self._vault.users -= 1
+                self._lock_if_unused(self._vault)
         self.sessionkey = None
+        self._vault = None
+
+    def _unlock(self, password):
+        """
+        Unlock the vault and return the session key
+        """
+        return self.bw("unlock", "--passwordenv", "BW_PASS", "--raw", environ=dict(BW_PASS=password))
+
+    def _lock(self):
+        self.bw("lock")
+
+    def _get_item(self, item_id):
+        """
+        Return an item of the vault, or None if there's none with this id
+        """
+        try:
+            return json.loads(self.bw("get", "item", item_id, session=self.sessionkey))
+        except AuthError as e:
+            if e.info.stderr == 'Not found.':
+                return None
+            raise
+
+    def _list_items(self):
+        return json.loads(self.bw("list", "items", session=self.sessionkey))
 
     def bw(self, *args, session=None, environ={}):
         if session:
@@ -36,10 +159,9 @@ class BitWardenAuthSource(AuthSource):
         return ret.stdout
 
     def get_item(self, item_id):
-        try:
-            item = self.bw("get", "item", item_id, session=self.sessionkey)
-            return json.loads(item)
-        except AuthError as e:
-            if e.info.stderr == 'Not found.':
-                return None 
-            raise
+        if self._vault and item_id in self._vault.items:
+            return self._vault.items[item_id]
+        item = self._get_item(item_id)
+        if self._vault and item is not None:
+            self._vault.items[item_id] = item
+        return item
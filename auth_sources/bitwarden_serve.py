@@ -0,0 +1,101 @@
+import time
+import threading
+import subprocess
+
+import requests
+
+from .base import AuthError
+from .bitwarden import BitWardenAuthSource, DEFAULT_CACHE_TTL
+
+# Seconds to wait for a bw serve that was started here to answer
+START_TIMEOUT = 30
+
+_servers = {}
+_http_sessions = {}
+# Servers that answered, so that their status isn't checked before every request
+_up = set()
+_lock = threading.Lock()
+
+def _http_session(url):
+    # One pooled connection per server, shared by all auth sources using it
+    with _lock:
+        if url not in _http_sessions:
+            _http_sessions[url] = requests.Session()
+        return _http_sessions[url]
+
+
+class BitWardenServeAuthSource(BitWardenAuthSource):
+    """
+    Bitwarden auth source that talks to the local REST API of a long running 'bw serve', instead of running bw for
+    every operation. If start is set and nothing answers on the port, 'bw serve' is started and kept running.
+    """
+    def __init__(self, path='/usr/local/bin:/usr/bin', cmd='bw', cache_ttl=DEFAULT_CACHE_TTL, port=8087, start=True, timeout=30):
+        super().__init__(path=path, cmd=cmd, cache_ttl=cache_ttl)
+        self._url = f'http://localhost:{port}'
+        self._cache_key = ('serve', self._url)
+        self._port = port
+        self._start = start
+        self._timeout = timeout
+        self._http = _http_session(self._url)
+
+    def _is_up(self):
+        try:
+            self._http.get(f'{self._url}/status', timeout=self._timeout)
+            return True
+        except requests.RequestException:
+            return False
+
+    def _ensure_server(self):
+        if self._url in _up:
+            return
+        with _lock:
+            server = _servers.get(self._url)
+            if (server is not None and server.poll() is None) or self._is_up():
+                _up.add(self._url)
+                return
+            if not self._start:
+                raise AuthError(f"bw serve isn't running on {self._url}", info=None)
+            server = subprocess.Popen((self._cmd, 'serve', '--hostname', 'localhost', '--port', str(self._port)), shell=False,
+                                      stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=self._environ_base)
+            _servers[self._url] = server
+        deadline = time.monotonic() + START_TIMEOUT
+        while not self._is_up():
+            if server.poll() is not None:
+                raise AuthError(f"bw serve exited with return code {server.returncode}", info=None)
+            if time.monotonic() > deadline:
+                raise AuthError(f"bw serve didn't start on {self._url}", info=None)
+            time.sleep(0.1)
+        _up.add(self._url)
+
+    def request(self, method, path, **kwargs):
+        """
+        Call the bw serve API and return the data of its response
+        """
+        self._ensure_server()
+        try:
+            response = self._http.request(method, f'{self._url}{path}', timeout=self._timeout, **kwargs)
+            body = response.json()
+        except (requests.RequestException, ValueError) as e:
+            if isinstance(e, requests.ConnectionError):
+                _up.discard(self._url)
+            raise AuthError(f"bw serve request failed: {e}", info=None)
+        if not body.get('success'):
+            raise AuthError(f"bw serve {method} {path} failed with status {response.status_code}: {body.get('message')}", info=response)
+        return body.get('data')
+
+    def _unlock(self, password):
+        return self.request('POST', '/unlock', json=dict(password=password))['raw']
+
+    def _lock(self):
+        self.request('POST', '/lock')
+
+    def _get_item(self, item_id):
+        try:
+            return self.request('GET', f'/object/item/{item_id}')
+        except AuthError as e:
+            if e.info is not None and e.info.status_code == 404:
+                return None
+            raise
+
+    def _list_items(self):
+        return self.request('GET', '/list/object/items')['data']
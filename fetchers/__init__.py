@@ -1,4 +1,6 @@
 from .utils import FetchException
+from .records import FetchedTransaction
+from .executor import fetch, iter_fetch
 
 from . import leumi
 from . import leumicard
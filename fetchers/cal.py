@@ -2,26 +2,123 @@
 import requests
 import re
 from datetime import datetime
-from transactions.models import Transaction
-from bs4 import BeautifulSoup
+from .records import FetchedTransaction
+import lxml.html
 import json
+import warnings
+from functools import cached_property
 
-from .utils import FetchException, get_input_tag
+from .utils import FetchException
+
+# Pages are ASP.NET postbacks, so a session can only fetch one month at a time
+CONCURRENT_MONTHS = False
+MAX_CONCURRENCY = 4
+
+def _text(element):
+    return element.text_content().strip()
+
+
+class CalPage:
+    """
+    A page of cal's site, parsed once. The parts the fetch stages need are extracted on first use and kept.
+    """
+    def __init__(self, page_text):
+        self.tree = lxml.html.fromstring(page_text.encode('utf-8'), parser=lxml.html.HTMLParser(encoding='utf-8'))
+
+    def find_id(self, element_id):
+        found = self.tree.xpath('//*[@id=$id]', id=element_id)
+        return found[0] if found else None
+
+    @cached_property
+    def inputs(self):
+        """
+        Dict of name to value of all named inputs, in page order
+        """
+        return { i.get('name'): i.get('value') for i in self.tree.xpath('//input[@name]') }
+
+    def hidden_fields(self, names):
+        return { name: value for name, value in self.inputs.items() if name in names }
+
+    @cached_property
+    def error(self):
+        error_box = self.find_id("ctl00_FormAreaNoBorder_FormArea_msgboxErrorMessages")
+        if error_box is None:
+            return None
+        return _text(error_box) or None
+
+    @cached_property
+    def bill_date(self):
+        bill_date_headline = self.find_id('ctl00_FormAreaNoBorder_FormArea_ctlMainToolBar_lblCaption')
+        if bill_date_headline is None:
+            raise RuntimeError("cal parse error: can't find bill date element")
+        return datetime.strptime(bill_date_headline.text_content().split()[-1], '%d/%m/%Y').date()
+
+    @cached_property
+    def rows(self):
+        main_grid = self.find_id('ctlMainGrid')
+        if main_grid is None:
+            raise RuntimeError("cal parse error: can't find transaction table element")
+        return main_grid.xpath('(.//tbody)[1]//tr')
+
+    @cached_property
+    def dates(self):
+        """
+        List of (value, text) of the bill dates that can be selected
+        """
+        dates_list = self.find_id('ctl00_FormAreaNoBorder_FormArea_clndrDebitDateScope_OptionList')
+        if dates_list is None:
+            raise RuntimeError("cal parse error: can't find dates list element")
+        return [ (tag.get('value', ''), tag.text_content()) for tag in dates_list.xpath('.//li') ]
+
+    @cached_property
+    def cards(self):
+        cards_list = self.find_id("ctl00_ContentTop_cboCardList_categoryList_pnlMain")
+        if cards_list is None:
+            raise RuntimeError("cal parse error: can't find cards list element")
+
+        try:
+            return [ { 'name': t.xpath('.//a')[0].text_content(), 'id': t.xpath('.//input')[0].attrib['value'], 'idx': i}
+                     for i, t in enumerate(cards_list.xpath('.//table')) ]
+        except (IndexError, KeyError):
+            raise RuntimeError("cal parse error: cards list is malformed")
+
+    @cached_property
+    def cards_by_number(self):
+        """
+        Dict of the last 4 digits of the card numbers to cards
+        """
+        cards = {}
+        for c in self.cards:
+            cards.setdefault(c['name'][-5:-1], c)
+        return cards
+
+
+def parse_page(page_text):
+    """
+    Parse a page of cal's site into a CalPage, which the rest of the functions here take
+    """
+    return CalPage(page_text)
+
+def get_hidden_fields(page, names):
+    """
+    Return a dict of name to value of the inputs of page with the given names
+    """
+    return page.hidden_fields(names)
 
 def parse_row(row_html, bill_date, from_account):
-    cols = row_html.find_all('td')
-    transaction_date_str = cols[0].text.strip()
-    description = cols[1].text.strip()
-    transaction_currency_symbol, transaction_amount_str = cols[2].text.strip().split(maxsplit=2)
-    bill_currency_symbol, bill_amount_str = cols[3].text.strip().split(maxsplit=2)
-    comment = cols[4].text.strip()
+    cols = row_html.xpath('./td')
+    transaction_date_str = _text(cols[0])
+    description = _text(cols[1])
+    transaction_currency_symbol, transaction_amount_str = _text(cols[2]).split(maxsplit=2)
+    bill_currency_symbol, bill_amount_str = _text(cols[3]).split(maxsplit=2)
+    comment = _text(cols[4])
 
     SYMBOL_TO_CURRENCY = {
             '₪': 'ILS',
             '$': 'USD',
             '€': 'EUR'}
 
-    return Transaction(
+    return FetchedTransaction(
             from_account = from_account,
             transaction_date = datetime.strptime(transaction_date_str, '%d/%m/%y').date(),
             bill_date = bill_date,
@@ -33,12 +130,7 @@ def parse_row(row_html, bill_date, from_account):
             )
 
 def parse_errors(page_html):
-    error_box = page_html.find(id="ctl00_FormAreaNoBorder_FormArea_msgboxErrorMessages")
-    if not error_box:
-        return None
-    else:
-        error_message = error_box.text.strip()
-        return error_message
+    return page_html.error
 
 def parse(page_html, from_account=None):
     error_message = parse_errors(page_html)
@@ -47,45 +139,26 @@ def parse(page_html, from_account=None):
             return []
         else:
             raise RuntimeError(f"cal: Error when fetching data: {error_message}")
-    
-    bill_date_headline = page_html.find(id='ctl00_FormAreaNoBorder_FormArea_ctlMainToolBar_lblCaption')
-    if bill_date_headline is None:
-        raise RuntimeError("cal parse error: can't find bill date element")
-    bill_date = datetime.strptime(bill_date_headline.text.split()[-1], '%d/%m/%Y').date()
-    main_grid = page_html.find(id='ctlMainGrid')
-    if main_grid is None:
-        raise RuntimeError("cal parse error: can't find transaction table element")
-    main_grid_body = main_grid.find('tbody')
-    rows = main_grid_body.find_all('tr')
-
-    return [ parse_row(r, bill_date, from_account) for r in rows ]
+
+    bill_date = page_html.bill_date
+    return [ parse_row(r, bill_date, from_account) for r in page_html.rows ]
 
 def select_date(month, year, parsed_html):
-    dates_list = parsed_html.find(id='ctl00_FormAreaNoBorder_FormArea_clndrDebitDateScope_OptionList')
-    if dates_list is None:
-        raise RuntimeError("cal parse error: can't find dates list element")
-    dates_entries = dates_list.find_all('li')
     date_value = f'{month:02d}{year:4d}'
 
-    for idx, tag in enumerate(dates_entries):
-        if tag.get('value', '') == date_value:
-            return idx, tag.text
+    for idx, (value, text) in enumerate(parsed_html.dates):
+        if value == date_value:
+            return idx, text
     raise RuntimeError("cal parse error: can't find requested date")
 
 def get_cards_list(parsed_html):
-    cards_list = parsed_html.find(id="ctl00_ContentTop_cboCardList_categoryList_pnlMain")
-    if cards_list is None:
-        raise RuntimeError("cal parse error: can't find cards list element")
+    return parsed_html.cards
 
+def select_card(parsed_html, card):
     try:
-        return [ { 'name': t.find('a').text, 'id': t.find('input')['value'], 'idx': i} for i, t in enumerate(cards_list.find_all('table')) ]
-    except (AttributeError, TypeError):
-        raise RuntimeError("cal parse error: cards list is malformed")
-
-def select_card(cards_list, card):
-    cards_numbers = [ c['name'][-5:-1] for c in cards_list ]
-    card_idx = cards_numbers.index(str(card))
-    return cards_list[card_idx]
+        return parsed_html.cards_by_number[str(card)]
+    except KeyError:
+        raise ValueError(f"cal parser: no card {card}")
 
 def select_card_payload(parsed_html, card):
     hidden_fields_names = [
@@ -96,8 +169,8 @@ def select_card_payload(parsed_html, card):
         "__EVENTVALIDATION",
         "ctl00$__MATRIX_VIEWSTATE",
         ]
-    hidden_fields = get_input_tag(parsed_html, hidden_fields_names)
-    selected_card = select_card(get_cards_list(parsed_html), card)
+    hidden_fields = get_hidden_fields(parsed_html, hidden_fields_names)
+    selected_card = select_card(parsed_html, card)
     return {
             '__EVENTTARGET': f"ctl00$ContentTop$cboCardList$categoryList$outerRep$ctl00$innerRep$ctl{selected_card['idx']:02d}$lnkItem",
             **hidden_fields
@@ -113,7 +186,7 @@ def transaction_payload(month, year, parsed_html):
         "ctl00$__MATRIX_VIEWSTATE",
         "cmbTransCashAccount_HiddenField",
         ]
-    hidden_fields = get_input_tag(parsed_html, hidden_fields_names)
+    hidden_fields = get_hidden_fields(parsed_html, hidden_fields_names)
     date_field_hidden, date_field_textbox = select_date(month, year, parsed_html)
     return {
         "__EVENTTARGET": "SubmitRequest",
@@ -131,8 +204,7 @@ def get_transaction_page(s, data=None, validate=None, post=None):
     _validate = validate or _default_validate
 
     def _default_post(s, response):
-        parsed_html = BeautifulSoup(response.text, 'html.parser')
-        return s, parsed_html
+        return s, parse_page(response.text)
     _post = post or _default_post
 
     url = "https://services.cal-online.co.il/Card-Holders/Screens/Transactions/Transactions.aspx"
@@ -152,7 +224,7 @@ def login_stage1():
     if not login_page.ok:
         raise FetchException('login failed: failed fetching login page', response=login_page)
 
-    data = get_input_tag(login_page.text, ['__EVENTVALIDATION', '__VIEWSTATEGENERATOR', '__VIEWSTATE'])
+    data = get_hidden_fields(parse_page(login_page.text), ['__EVENTVALIDATION', '__VIEWSTATEGENERATOR', '__VIEWSTATE'])
     if len(data) != 3:
         raise FetchException('login failed: bad login page format', response=login_page)
     return s, data
@@ -193,20 +265,51 @@ def login(user, passwd):
     s, token = login_stage2(s, user, passwd)
     return login_stage3(s, data, token)
 
-def get_month_transactions(s, month, year, accounts):
-    try:
-        s, transaction_page = get_transaction_page(s)
-        transactions = []
-        for a in accounts:
-            try:
-                payload = select_card_payload(transaction_page, a.backend_id)
-            except ValueError:
-                print("cal parser: couldn't find card for account:", a)
-                continue
-            s = get_transaction_page(s, payload, validate=lambda r: r.ok is True, post=lambda s, r: s)
+def is_session_alive(s):
+    # A logged out session is redirected to the login page. HEAD tells without downloading the page.
+    url = 'https://services.cal-online.co.il/card-holders/Screens/AccountManagement/HomePage.aspx'
+    response = s.head(url, allow_redirects=False, timeout=10)
+    return response.status_code == 200
+
+def iter_months_transactions(s, months, accounts):
+    """
+    Fetch the transactions of accounts for every (month, year) in months. Yield a list of the transactions of every
+    month, in order, as soon as the month is fetched for all accounts.
+
+    Each card is selected once, then its months are selected one after the other, every postback carrying the
+    hidden fields of the page before it. So months are done for the last card as it walks them.
+    """
+    s, transaction_page = get_transaction_page(s)
+    missing = [ a.backend_id for a in accounts if str(a.backend_id) not in transaction_page.cards_by_number ]
+    if missing:
+        warnings.warn(f"cal: skipped accounts without a card: {', '.join(missing)}")
+    found = [ a for a in accounts if str(a.backend_id) in transaction_page.cards_by_number ]
+    if not found:
+        for _ in months:
+            yield []
+        return
+
+    transactions = [ [] for _ in months ]
+    for account_idx, a in enumerate(found):
+        payload = select_card_payload(transaction_page, a.backend_id)
+        s = get_transaction_page(s, payload, validate=lambda r: r.ok is True, post=lambda s, r: s)
+        for month_idx, (month, year) in enumerate(months):
             payload = transaction_payload(month, year, transaction_page)
             s, transaction_page = get_transaction_page(s, payload)
-            transactions += parse(transaction_page, from_account=a)
-        return transactions
-    except FetchException:
-        raise
+            transactions[month_idx] += parse(transaction_page, from_account=a)
+            if account_idx == len(found) - 1:
+                yield transactions[month_idx]
+                transactions[month_idx] = None
+
+def get_range_transactions(s, months, accounts, split=True):
+    """
+    Like iter_months_transactions, returning a list of the transactions of every month if split is set, otherwise
+    a single list
+    """
+    transactions = list(iter_months_transactions(s, months, accounts))
+    if not split:
+        return [ t for month_transactions in transactions for t in month_transactions ]
+    return transactions
+
+def get_month_transactions(s, month, year, accounts):
+    return get_range_transactions(s, [(month, year)], accounts)[0]
@@ -0,0 +1,131 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import sessions
+
+# Backends can set these module attributes:
+#   MAX_CONCURRENCY - how many logins and fetches may run at once against the backend, across all fetches
+#   CONCURRENT_MONTHS - whether a logged in session may fetch several months at once
+# Backends that can fetch a range of months more cheaply than month by month define
+# iter_months_transactions(session, months, accounts), a generator yielding a list of transactions for every month, in
+# order. It's used instead of get_month_transactions when months aren't fetched concurrently, and every month is
+# passed on as soon as it's yielded.
+DEFAULT_MAX_CONCURRENCY = 4
+# How many months fetched one after the other may wait for the caller, before fetching more waits for it
+MONTHS_BUFFERED = 2
+# Seconds between checks for the caller stopping, while waiting for it to take a month
+_STOP_POLL_INTERVAL = 0.1
+
+_limits = {}
+_limits_lock = threading.Lock()
+
+def _backend_limit(backend):
+    with _limits_lock:
+        if backend not in _limits:
+            _limits[backend] = threading.BoundedSemaphore(getattr(backend, 'MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY))
+        return _limits[backend]
+
+def iter_fetch(backend, groups, months, session_pool=None):
+    """
+    Fetch the transactions of groups of accounts over a list of months, concurrently.
+
+    groups is a list of (authinfo, accounts) pairs, where authinfo is a dict with username and password, and the
+    accounts share it. Groups are logged into and fetched concurrently. Months of a group are fetched concurrently
+    too if the backend allows it, or one after the other on the group's session otherwise.
+    Sessions are taken from session_pool (fetchers.sessions.pool by default) when there's a live one, and returned
+    to it when done.
+
+    Yields (group index, month index, transactions) in order of groups then months, each as soon as it and
+    everything before it are fetched.
+    """
+    session_pool = session_pool or sessions.pool
+    limit = _backend_limit(backend)
+    def limited(f, *args):
+        with limit:
+            return f(*args)
+    def lease(authinfo):
+        return session_pool.lease(backend, authinfo, login=lambda user, passwd: limited(backend.login, user, passwd))
+    def fetch_month(lease, month, year, accounts):
+        return lease.call(lambda s, *args: limited(backend.get_month_transactions, s, *args), month, year, accounts)
+    def iter_limited(f, *args):
+        # Hold the limit while a month is fetched, not while the caller handles it
+        results = f(*args)
+        while True:
+            with limit:
+                try:
+                    result = next(results)
+                except StopIteration:
+                    return
+            yield result
+    def iter_months(lease, accounts):
+        if hasattr(backend, 'iter_months_transactions'):
+            return lease.iter_call(lambda s, *args: iter_limited(backend.iter_months_transactions, s, *args), months, accounts)
+        return ( fetch_month(lease, m, y, accounts) for m, y in months )
+    def put(results, item):
+        # Wait for room on results, unless the caller stopped. Return whether the item was put.
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=_STOP_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+    def fetch_sequentially(lease, accounts, results):
+        # Put (True, transactions) for every month on results as it's fetched, or (False, exception) on failure
+        try:
+            for transactions in iter_months(lease, accounts):
+                if not put(results, (True, transactions)):
+                    return
+        except BaseException as e:
+            put(results, (False, e))
+    def sequential_results(results):
+        for _ in months:
+            fetched, value = results.get()
+            if not fetched:
+                raise value
+            yield value
+
+    max_workers = getattr(backend, 'MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY)
+    concurrent_months = getattr(backend, 'CONCURRENT_MONTHS', False)
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    leases = []
+    stopped = threading.Event()
+    ok = False
+    try:
+        leases = [ pool.submit(lease, authinfo) for authinfo, _ in groups ]
+        fetches = []
+        for group_lease, (_, accounts) in zip(leases, groups):
+            group_lease = group_lease.result()
+            if concurrent_months:
+                fetches.append([ pool.submit(fetch_month, group_lease, m, y, accounts) for m, y in months ])
+            else:
+                results = queue.Queue(maxsize=MONTHS_BUFFERED)
+                pool.submit(fetch_sequentially, group_lease, accounts, results)
+                fetches.append(sequential_results(results))
+
+        for group_idx, group_fetches in enumerate(fetches):
+            if concurrent_months:
+                group_fetches = ( f.result() for f in group_fetches )
+            for month_idx, transactions in enumerate(group_fetches):
+                yield group_idx, month_idx, transactions
+        ok = True
+    except GeneratorExit:
+        # The caller stopped early, the sessions are still good
+        ok = True
+        raise
+    finally:
+        stopped.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+        for f in leases:
+            if f.done() and not f.cancelled() and f.exception() is None:
+                f.result().release(ok)
+
+def fetch(backend, groups, months, session_pool=None):
+    """
+    Like iter_fetch, returning a single list of all transactions, in order of groups then months
+    """
+    transactions = []
+    for _, _, month_transactions in iter_fetch(backend, groups, months, session_pool):
+        transactions += month_transactions
+    return transactions
@@ -1,40 +1,73 @@
 import csv
+import codecs
 import datetime
+import warnings
 import requests
-from transactions.models import Transaction
+from .records import FetchedTransaction
 
 from retry import retry
 
-from .utils import get_input_tag, FetchException
+from .utils import get_input_tag, FetchException, AccountIndex
 
-def parseBankinDat(accounts, bankin):
+# Pages are ASP.NET postbacks, so a session can only fetch one month at a time
+CONCURRENT_MONTHS = False
+MAX_CONCURRENCY = 4
+
+def iter_bankin_dat(accounts, bankin):
+    """
+    Yield the transactions of the lines of a Bankin.dat export, as they're read from bankin.
+    Lines of unknown accounts and malformed lines are skipped, and reported together when done.
+    """
     c = csv.reader(bankin)
     get_date = lambda d: datetime.datetime.strptime(d, '%d%m%y').date()
-    get_account = lambda a: next(filter(lambda x: x.backend_id == a, accounts))
+    account_index = AccountIndex(accounts)
     def parse_entry(e):
-        try:
-            amount = float(e[3])
-            if amount < 0:
-                return Transaction(from_account=get_account(e[6]),
-                                   transaction_date=get_date(e[1]),
-                                   bill_date=get_date(e[1]),
-                                   transaction_amount=abs(amount),
-                                   billed_amount=abs(amount),
-                                   description=e[2][::-1],
-                                   confirmation=int(e[0]))
-            return Transaction(to_account=get_account(e[6]),
+        amount = float(e[3])
+        account = account_index.get(e[6])
+        if account is None:
+            return None
+        if amount < 0:
+            return FetchedTransaction(from_account=account,
                                transaction_date=get_date(e[1]),
                                bill_date=get_date(e[1]),
                                transaction_amount=abs(amount),
                                billed_amount=abs(amount),
                                description=e[2][::-1],
                                confirmation=int(e[0]))
-        except:
-            return None
-
-    transactions = ( parse_entry(l) for l in c )
+        return FetchedTransaction(to_account=account,
+                           transaction_date=get_date(e[1]),
+                           bill_date=get_date(e[1]),
+                           transaction_amount=abs(amount),
+                           billed_amount=abs(amount),
+                           description=e[2][::-1],
+                           confirmation=int(e[0]))
+
+    for line in c:
+        try:
+            transaction = parse_entry(line)
+        except (ValueError, IndexError):
+            account_index.malformed += 1
+            continue
+        if transaction is not None:
+            yield transaction
+    account_index.report('leumi')
 
-    return list(filter(None, transactions))
+def parseBankinDat(accounts, bankin):
+    return list(iter_bankin_dat(accounts, bankin))
+
+def iter_csv_lines(response, encoding='cp862', chunk_size=64 * 1024):
+    """
+    Yield the non-empty lines of a streamed export response, decoding it a chunk at a time
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        lines = (pending + decoder.decode(chunk)).split('\r\n')
+        pending = lines.pop()
+        yield from filter(None, lines)
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
 
 def requests_movements_page(s, data=None, timeout=10):
     url = 'https://hb2.bankleumi.co.il/ebanking/Accounts/ExtendedActivity.aspx?WidgetPar=1'
@@ -48,6 +81,13 @@ def requests_movements_page(s, data=None, timeout=10):
     return r
 
 def fetch_csv(s, from_date, to_date, encoding='cp862'):
+    return list(fetch_csv_lines(s, from_date, to_date, encoding))
+
+def fetch_csv_lines(s, from_date, to_date, encoding='cp862'):
+    """
+    Export the transactions between from_date and to_date. Return an iterator of the lines of the export, read as
+    they're downloaded.
+    """
     def query(movements_page):
         d1 = get_input_tag(movements_page.text, '__VIEWSTATE')
         d2 = get_input_tag(movements_page.text, '__EVENTVALIDATION')
@@ -85,13 +125,7 @@ def fetch_csv(s, from_date, to_date, encoding='cp862'):
         return response
 
     csv_response = get_csv(query(requests_movements_page(s)))
-    chunk_size = int(csv_response.headers['Content-Length'].split(',')[0].strip())
-    content_iter = csv_response.iter_content(chunk_size=chunk_size)
-    content_bytes = next(content_iter)
-    content_text = content_bytes.decode(encoding)
-    content_lines = list(filter(None, content_text.split('\r\n')))
-
-    return content_lines
+    return iter_csv_lines(csv_response, encoding)
 
 @retry(requests.ReadTimeout, tries=3, delay=1)
 def login(user, passwd, timeout=10):
@@ -114,11 +148,73 @@ def login(user, passwd, timeout=10):
 
     return s
 
-def get_month_transactions(s, month, year, accounts):
-    from_date = datetime.date(year, month, 1).strftime('%d/%m/%y')
+def is_session_alive(s, timeout=10):
+    # A logged out session is redirected to the login page. The page itself isn't needed.
+    url = 'https://hb2.bankleumi.co.il/ebanking/Accounts/ExtendedActivity.aspx?WidgetPar=1'
+    with s.get(url, allow_redirects=False, timeout=timeout, stream=True) as response:
+        return response.status_code == 200
+
+def _last_day(month, year):
     inc_month = 1 + (month % 12)
     inc_year = year + month // 12
-    to_date = (datetime.date(inc_year, inc_month, 1) - datetime.timedelta(days=1)).strftime('%d/%m/%y')
-    
-    csv = fetch_csv(s, from_date, to_date)
-    return parseBankinDat(accounts, csv)
+    return datetime.date(inc_year, inc_month, 1) - datetime.timedelta(days=1)
+
+def iter_range_transactions(s, months, accounts):
+    """
+    Yield the transactions of accounts from the start of the first of months to the end of the last, from one
+    export, as it's downloaded
+    """
+    first_month, first_year = months[0]
+    last_month, last_year = months[-1]
+    from_date = datetime.date(first_year, first_month, 1).strftime('%d/%m/%y')
+    to_date = _last_day(last_month, last_year).strftime('%d/%m/%y')
+    return iter_bankin_dat(accounts, fetch_csv_lines(s, from_date, to_date))
+
+def iter_months_transactions(s, months, accounts):
+    """
+    Yield a list of the transactions of accounts of every (month, year) in months, in order, from one export.
+
+    Months are yielded as soon as the export is known to be in ascending date order, that is once a transaction of
+    a later month follows one of an earlier month, and every month before the later one is done. Otherwise, like
+    for a newest first export, transactions are kept until the export ends.
+    If a transaction of a month that was already yielded comes after all, it's put in the first month that wasn't,
+    so it's not lost, and the rest of the export is kept until it ends.
+    """
+    month_indexes = { month: i for i, month in enumerate(months) }
+    by_month = [ [] for _ in months ]
+    yielded = 0
+    last_idx = None
+    ascending = None
+    late = 0
+    for t in iter_range_transactions(s, months, accounts):
+        month_idx = month_indexes.get((t.transaction_date.month, t.transaction_date.year))
+        if month_idx is None:
+            continue
+        if ascending is None and last_idx is not None and month_idx != last_idx:
+            ascending = month_idx > last_idx
+        last_idx = month_idx
+        if month_idx < yielded:
+            late += 1
+            ascending = False
+            month_idx = yielded
+        by_month[month_idx].append(t)
+        while ascending and yielded < month_idx:
+            yield by_month[yielded]
+            by_month[yielded] = None
+            yielded += 1
+    if late:
+        warnings.warn(f"leumi: export isn't sorted by date, {late} transactions were returned with a later month")
+    for month_transactions in by_month[yielded:]:
+        yield month_transactions
+
+def get_range_transactions(s, months, accounts, split=True):
+    """
+    Like iter_range_transactions. If split is set return a list of the transactions of every month, in order,
+    otherwise a single list.
+    """
+    if not split:
+        return list(iter_range_transactions(s, months, accounts))
+    return list(iter_months_transactions(s, months, accounts))
+
+def get_month_transactions(s, month, year, accounts):
+    return get_range_transactions(s, [(month, year)], accounts, split=False)
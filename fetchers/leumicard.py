@@ -1,10 +1,16 @@
 #!/usr/bin/python
 import requests
 from datetime import datetime
-from transactions.models import Transaction
+from .records import FetchedTransaction
 import json
 
-from .utils import FetchException
+from .utils import FetchException, AccountIndex
+
+# The API is stateless, so months can be fetched concurrently on one session
+CONCURRENT_MONTHS = True
+MAX_CONCURRENCY = 4
+# There's no cheap way to check that a session is still logged in, so sessions aren't kept for later fetches
+SESSION_TTL = 0
 
 def get_month_transactions_raw(s, month, year):
     data = {"userIndex":-1, "cardIndex":-1, "monthView": True , "date": f"{year:d}-{month:02d}-01", "bankAccount": {"bankAccountIndex": -1, "cards": None}}
@@ -20,11 +26,14 @@ def get_month_transactions_raw(s, month, year):
     return response_data
 
 def parse_transactions(accounts, transaction_dicts):
-    get_account = lambda a: next(filter(lambda x: x.backend_id == a, accounts))
+    account_index = AccountIndex(accounts)
     def parse_entry(d):
         try:
-            return Transaction(
-                    from_account = get_account(d['shortCardNumber']),
+            account = account_index.get(d['shortCardNumber'])
+            if account is None:
+                return None
+            return FetchedTransaction(
+                    from_account = account,
                     transaction_date = datetime.fromisoformat(d['purchaseDate']).date(),
                     bill_date = datetime.fromisoformat(d['paymentDate']).date(),
                     description = d['merchantName'],
@@ -33,10 +42,12 @@ def parse_transactions(accounts, transaction_dicts):
                     original_currency = d['originalCurrency'],
                     notes = d['comments']
                     )
-        except:
+        except (KeyError, ValueError, TypeError):
+            account_index.malformed += 1
             return None
 
-    transactions = ( parse_entry(d) for d in transaction_dicts )
+    transactions = [ parse_entry(d) for d in transaction_dicts ]
+    account_index.report('leumicard')
 
     return list(filter(None, transactions))
 
@@ -1,13 +1,17 @@
 import time
 import datetime
+import warnings
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.firefox.options import Options
-from selenium.common.exceptions import NoSuchElementException, NoSuchWindowException
+from selenium.common.exceptions import NoSuchElementException, NoSuchWindowException, WebDriverException
 from selenium.webdriver.support import expected_conditions
 
-from transactions.models import Transaction
+from .records import FetchedTransaction
+
+# Every login launches a browser
+MAX_CONCURRENCY = 2
 
 def parse_transaction(account, value_list):
     date = datetime.datetime.strptime(value_list[0], '%d/%m/%Y').date()
@@ -27,7 +31,7 @@ def parse_transaction(account, value_list):
     else:
         raise ValueError("Empty transaction")
 
-    return Transaction(from_account=from_account, to_account=to_account, transaction_date=date,
+    return FetchedTransaction(from_account=from_account, to_account=to_account, transaction_date=date,
             bill_date=date, transaction_amount=amount, billed_amount=amount,
             original_currency='ILS', description=description, confirmation=confirmation)
 
@@ -87,14 +91,30 @@ def login(username, password):
 
     return driver
 
+def is_session_alive(driver):
+    try:
+        driver.current_url
+        return True
+    except WebDriverException:
+        return False
+
+def close_session(driver):
+    driver.quit()
+
 def get_month_transactions(driver, month, year, accounts):
     raw_transactions = fetch_raw_transactions(driver, month, year)
     account = accounts[0]
     
     transactions = []
+    malformed = 0
     for t in raw_transactions:
+        if not t:
+            # Header rows have no cells
+            continue
         try:
             transactions.append(parse_transaction(account, t))
-        except:
-            pass
+        except (ValueError, IndexError):
+            malformed += 1
+    if malformed:
+        warnings.warn(f"otsar: skipped {malformed} malformed rows")
     return transactions
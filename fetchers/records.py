@@ -0,0 +1,83 @@
+import datetime
+from decimal import Decimal
+
+FIELDS = ('transaction_date', 'bill_date', 'from_account', 'to_account', 'transaction_amount', 'description', 'category',
+          'original_currency', 'billed_amount', 'confirmation', 'notes')
+
+_AMOUNT_QUANTUM = Decimal('0.001')
+
+def _date(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    return value.isoformat()
+
+def _amount(value):
+    if value is None:
+        return None
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value).strip())
+    return value.quantize(_AMOUNT_QUANTUM)
+
+def _slug(value, field):
+    return None if value is None else getattr(value, field)
+
+
+class FetchedTransaction:
+    """
+    A transaction as parsed by a fetcher. It has the fields of transactions.models.Transaction, without needing
+    Django, and is only turned into a model instance when it's stored.
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, transaction_date=None, bill_date=None, from_account=None, to_account=None, transaction_amount=None,
+                 description='', category=None, original_currency=None, billed_amount=None, confirmation=None, notes=None):
+        self.transaction_date = transaction_date
+        self.bill_date = bill_date
+        self.from_account = from_account
+        self.to_account = to_account
+        self.transaction_amount = transaction_amount
+        self.description = description
+        self.category = category
+        self.original_currency = original_currency
+        self.billed_amount = billed_amount
+        self.confirmation = confirmation
+        self.notes = notes
+
+    @property
+    def from_account_id(self):
+        return getattr(self.from_account, 'pk', None)
+
+    @property
+    def to_account_id(self):
+        return getattr(self.to_account, 'pk', None)
+
+    def __repr__(self):
+        return f'<FetchedTransaction {self.billed_amount} {self.description!r} on {self.transaction_date}>'
+
+    def to_dict(self):
+        """
+        Return the transaction as TransactionSerializer would represent its model instance
+        """
+        return {
+            'id': None,
+            'transaction_date': _date(self.transaction_date),
+            'bill_date': _date(self.bill_date),
+            'from_account': _slug(self.from_account, 'name'),
+            'to_account': _slug(self.to_account, 'name'),
+            'transaction_amount': _amount(self.transaction_amount),
+            'description': None if self.description is None else str(self.description),
+            'category': _slug(self.category, 'title'),
+            'original_currency': None if self.original_currency is None else str(self.original_currency),
+            'billed_amount': _amount(self.billed_amount),
+            'confirmation': None if self.confirmation is None else int(self.confirmation),
+            'notes': None if self.notes is None else str(self.notes),
+        }
+
+    def to_model(self):
+        """
+        Return an unsaved transactions.models.Transaction of this transaction
+        """
+        from transactions.models import Transaction
+        return Transaction(**{ field: getattr(self, field) for field in FIELDS })
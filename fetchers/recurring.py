@@ -1,9 +1,11 @@
 import warnings
 import datetime
 
-from transactions.models import Transaction, Account
+from .records import FetchedTransaction
 from .utils import FetchException
 
+CONCURRENT_MONTHS = True
+
 
 def get_expense(month, year, account):
     today = datetime.datetime(year, month, 1)
@@ -15,11 +17,11 @@ def get_expense(month, year, account):
         description = "Saving"
     if end_date and today > end_date:
         return None
-    return Transaction(to_account=account, transaction_amount=amount, billed_amount=amount, original_currency='ILS',
+    return FetchedTransaction(to_account=account, transaction_amount=amount, billed_amount=amount, original_currency='ILS',
                        transaction_date=today, bill_date=today, description=description)
 
 def get_month_transactions(_, month, year, accounts):
-    return list(filter([get_expense(month, year, a) for a in accounts]))
+    return list(filter(None, [get_expense(month, year, a) for a in accounts]))
 
 def login(*args, **kwargs):
     pass
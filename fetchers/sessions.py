@@ -0,0 +1,178 @@
+import time
+import hashlib
+import threading
+
+from .utils import FetchException
+
+# Backends can set these module attributes:
+#   SESSION_TTL - seconds since login after which a session isn't reused
+#   SESSION_IDLE_TIMEOUT - seconds since last use after which a session isn't reused
+#   is_session_alive(session) - health check done before a session is reused
+#   close_session(session) - release what a session holds. Otherwise sessions are closed with their close() method.
+DEFAULT_SESSION_TTL = 15 * 60
+DEFAULT_SESSION_IDLE_TIMEOUT = 5 * 60
+
+def _key(backend, authinfo):
+    # The password is part of the key so that changed credentials log in again
+    password_hash = hashlib.sha256(authinfo['password'].encode()).hexdigest()
+    return (backend, authinfo['username'], password_hash)
+
+def close_session(backend, session):
+    try:
+        if hasattr(backend, 'close_session'):
+            backend.close_session(session)
+        elif hasattr(session, 'close'):
+            session.close()
+    except Exception:
+        pass
+
+
+class _PooledSession:
+    def __init__(self, session):
+        self.session = session
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+    def expired(self, backend, now):
+        ttl = getattr(backend, 'SESSION_TTL', DEFAULT_SESSION_TTL)
+        idle_timeout = getattr(backend, 'SESSION_IDLE_TIMEOUT', DEFAULT_SESSION_IDLE_TIMEOUT)
+        return now - self.created > ttl or now - self.last_used > idle_timeout
+
+
+class Lease:
+    """
+    A logged in session of a backend, checked out of a SessionPool for the duration of a fetch
+    """
+    def __init__(self, pool, backend, authinfo, login):
+        self.pool = pool
+        self.backend = backend
+        self.authinfo = authinfo
+        self._login = login
+        self._lock = threading.Lock()
+        self._pooled = pool._take(backend, authinfo)
+        self.reused = self._pooled is not None
+        if self._pooled is None:
+            self._pooled = _PooledSession(login(authinfo['username'], authinfo['password']))
+
+    @property
+    def session(self):
+        return self._pooled.session
+
+    def call(self, f, *args):
+        """
+        Call f with the session and args. If a reused session fails, log in again and retry once.
+        """
+        pooled = self._pooled
+        try:
+            return f(pooled.session, *args)
+        except FetchException:
+            if not self._renew(pooled):
+                raise
+            return f(self.session, *args)
+
+    def iter_call(self, f, items, *args):
+        """
+        Like call for a generator function f that yields a result for every one of items, in order. If a reused
+        session fails, log in again and resume with the items that weren't yielded yet.
+        """
+        pooled = self._pooled
+        done = 0
+        try:
+            for result in f(pooled.session, items, *args):
+                done += 1
+                yield result
+        except FetchException:
+            if not self._renew(pooled):
+                raise
+            yield from f(self.session, items[done:], *args)
+
+    def _renew(self, failed):
+        with self._lock:
+            if self._pooled is not failed:
+                # Another month of the same fetch already logged in again
+                return True
+            if not self.reused:
+                return False
+            close_session(self.backend, failed.session)
+            self._pooled = _PooledSession(self._login(self.authinfo['username'], self.authinfo['password']))
+            self.reused = False
+            return True
+
+    def release(self, ok=True):
+        """
+        Return the session to the pool, or close it if the fetch using it failed
+        """
+        if ok:
+            self.pool._put(self.backend, self.authinfo, self._pooled)
+        else:
+            close_session(self.backend, self.session)
+
+
+class SessionPool:
+    """
+    Logged in sessions of backends, kept between fetches so they can skip logging in.
+
+    Sessions are keyed by backend and credentials. A session is used by one fetch at a time: concurrent fetches
+    with the same credentials log in separately, and both sessions are kept.
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def lease(self, backend, authinfo, login=None):
+        """
+        Return a Lease of a live session for authinfo, logging in with login (backend.login by default) if there is none
+        """
+        return Lease(self, backend, authinfo, login or backend.login)
+
+    def _take(self, backend, authinfo):
+        self.evict()
+        key = _key(backend, authinfo)
+        while True:
+            with self._lock:
+                available = self._sessions.get(key)
+                if not available:
+                    return None
+                pooled = available.pop()
+            is_alive = getattr(backend, 'is_session_alive', None)
+            try:
+                alive = is_alive is None or is_alive(pooled.session)
+            except Exception:
+                alive = False
+            if alive:
+                return pooled
+            close_session(backend, pooled.session)
+
+    def _put(self, backend, authinfo, pooled):
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._sessions.setdefault(_key(backend, authinfo), []).append(pooled)
+        self.evict()
+
+    def evict(self):
+        """
+        Close and remove sessions that are past their TTL or idle timeout
+        """
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, available in self._sessions.items():
+                backend = key[0]
+                expired += [ (backend, p.session) for p in available if p.expired(backend, now) ]
+                available[:] = [ p for p in available if not p.expired(backend, now) ]
+            self._sessions = { k: v for k, v in self._sessions.items() if v }
+        for backend, session in expired:
+            close_session(backend, session)
+
+    def clear(self):
+        """
+        Close and remove all sessions
+        """
+        with self._lock:
+            sessions = [ (key[0], p.session) for key, available in self._sessions.items() for p in available ]
+            self._sessions = {}
+        for backend, session in sessions:
+            close_session(backend, session)
+
+
+pool = SessionPool()
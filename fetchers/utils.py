@@ -1,3 +1,6 @@
+import warnings
+from collections import Counter
+
 from bs4 import BeautifulSoup
 
 class FetchException(Exception):
@@ -6,6 +9,38 @@ class FetchException(Exception):
         self.response = response
 
 
+class AccountIndex:
+    """
+    The accounts of a fetch by their backend id, built once per fetch. Ids that aren't found are counted so they can
+    be reported together with report(), instead of row by row.
+    """
+    def __init__(self, accounts):
+        self._accounts = {}
+        for a in accounts:
+            self._accounts.setdefault(a.backend_id, a)
+        self.unknown = Counter()
+        self.malformed = 0
+
+    def get(self, backend_id):
+        """
+        Return the account with backend_id, or None if there's none
+        """
+        account = self._accounts.get(backend_id)
+        if account is None:
+            self.unknown[backend_id] += 1
+        return account
+
+    def report(self, backend_name):
+        """
+        Warn about the rows skipped because their account is unknown or they're malformed
+        """
+        if self.unknown:
+            ids = ', '.join(f'{i} ({n})' for i, n in self.unknown.items())
+            warnings.warn(f"{backend_name}: skipped {sum(self.unknown.values())} transactions of unknown accounts: {ids}")
+        if self.malformed:
+            warnings.warn(f"{backend_name}: skipped {self.malformed} malformed transactions")
+
+
 def get_input_tag(raw_html, name):
     if isinstance(raw_html, BeautifulSoup):
         parsed_html = raw_html
@@ -132,3 +132,11 @@ STATIC_URL = '/static/'
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False
 }
+
+# Number of fetch jobs that run at once in the background
+FETCH_JOB_WORKERS = 2
+# Seconds between the heartbeats of queued and running fetch jobs. Jobs that miss three are marked failed.
+FETCH_JOB_HEARTBEAT_INTERVAL = 30
+
+# Months before the last synced transaction that since_last_sync fetches get again, for late posting transactions
+SYNC_OVERLAP_MONTHS = 1
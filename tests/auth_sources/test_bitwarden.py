@@ -0,0 +1,95 @@
+import json
+import subprocess
+from unittest import TestCase, mock
+
+from auth_sources import bitwarden, AuthError
+
+
+ITEMS = [ dict(id=f'item{i}', login=dict(username=f'user{i}', password=f'pass{i}')) for i in range(5) ]
+
+def fake_run_bw(calls):
+    def run_bw(self, *args, environ={}):
+        calls.append(args[:2])
+        if args[0] == 'unlock':
+            if environ['BW_PASS'] != 'master':
+                return subprocess.CompletedProcess(args, 1, '', 'Invalid master password.')
+            return subprocess.CompletedProcess(args, 0, 'sessionkey', '')
+        if args[:2] == ('list', 'items'):
+            return subprocess.CompletedProcess(args, 0, json.dumps(ITEMS), '')
+        if args[:2] == ('get', 'item'):
+            item = [ i for i in ITEMS if i['id'] == args[2] ]
+            if not item:
+                return subprocess.CompletedProcess(args, 1, '', 'Not found.')
+            return subprocess.CompletedProcess(args, 0, json.dumps(item[0]), '')
+        return subprocess.CompletedProcess(args, 0, '', '')
+    return run_bw
+
+
+class CacheTest(TestCase):
+    def setUp(self):
+        self.calls = []
+        patcher = mock.patch.object(bitwarden.BitWardenAuthSource, '_run_bw', fake_run_bw(self.calls))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(bitwarden._vaults.clear)
+
+    def fetch(self, password='master', item_ids=[ f'item{i}' for i in range(5) ], **settings):
+        source = bitwarden.BitWardenAuthSource(**settings)
+        with source.unlock(password):
+            return source.get_auth_infos(item_ids)
+
+    def test_batch(self):
+        infos = self.fetch()
+        self.assertEqual(infos[3], dict(username='user3', password='pass3'))
+        self.assertEqual(self.calls, [('unlock', '--passwordenv'), ('list', 'items')])
+
+    def test_cached(self):
+        self.fetch()
+        self.assertEqual(self.fetch()[4], dict(username='user4', password='pass4'))
+        self.assertEqual(self.calls, [('unlock', '--passwordenv'), ('list', 'items')])
+
+    def test_wrong_password(self):
+        self.fetch()
+        self.assertRaises(AuthError, self.fetch, password='wrong')
+
+    def test_expired(self):
+        self.fetch()
+        bitwarden._vaults[next(iter(bitwarden._vaults))].expires = 0
+        self.fetch()
+        self.assertEqual(self.calls.count(('unlock', '--passwordenv')), 2)
+
+    def test_expired_in_use(self):
+        source = bitwarden.BitWardenAuthSource().unlock('master')
+        vault = source._vault
+        source._expire(vault)
+        self.assertNotIn(('lock',), self.calls)
+        # Not reused once it expired, even if it's still in use
+        other = bitwarden.BitWardenAuthSource().unlock('master')
+        current = other._vault
+        self.assertIsNot(current, vault)
+        other.lock()
+        # Locking the replaced vault would lock the current one too
+        source.lock()
+        self.assertNotIn(('lock',), self.calls)
+        other._expire(current)
+        self.assertEqual(self.calls.count(('lock',)), 1)
+
+    def test_released_after_expiry(self):
+        source = bitwarden.BitWardenAuthSource().unlock('master')
+        source._expire(source._vault)
+        source.lock()
+        self.assertEqual(self.calls.count(('lock',)), 1)
+        self.assertEqual(bitwarden._vaults, {})
+
+    def test_disabled(self):
+        self.fetch(cache_ttl=0)
+        self.fetch(cache_ttl=0)
+        self.assertEqual(self.calls, [('unlock', '--passwordenv'), ('list', 'items'), ('lock',)] * 2)
+
+    def test_single_item(self):
+        self.assertEqual(self.fetch(item_ids=['item1']), [dict(username='user1', password='pass1')])
+        self.assertEqual(self.calls, [('unlock', '--passwordenv'), ('get', 'item')])
+
+    def test_not_found(self):
+        self.assertRaises(AuthError, self.fetch, item_ids=['item1', 'nope'])
+        self.assertRaises(AuthError, self.fetch, item_ids=['nope'])
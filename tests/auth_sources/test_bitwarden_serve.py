@@ -0,0 +1,97 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase, mock
+
+import requests
+
+from auth_sources import bitwarden, bitwarden_serve, AuthError
+
+
+ITEMS = { f'item{i}': dict(id=f'item{i}', login=dict(username=f'user{i}', password=f'pass{i}')) for i in range(3) }
+
+
+class StubBwServe(BaseHTTPRequestHandler):
+    """
+    The parts of the bw serve API the auth source uses
+    """
+    calls = []
+
+    def respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.calls.append(('GET', self.path))
+        if self.path == '/status':
+            self.respond(200, dict(success=True, data=dict(template=dict(status='unlocked'))))
+        elif self.path == '/list/object/items':
+            self.respond(200, dict(success=True, data=dict(object='list', data=list(ITEMS.values()))))
+        elif self.path.startswith('/object/item/') and self.path.split('/')[-1] in ITEMS:
+            self.respond(200, dict(success=True, data=ITEMS[self.path.split('/')[-1]]))
+        else:
+            self.respond(404, dict(success=False, message='Not found.'))
+
+    def do_POST(self):
+        self.calls.append(('POST', self.path))
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or '{}')
+        if self.path == '/unlock' and body.get('password') == 'master':
+            self.respond(200, dict(success=True, data=dict(title='Your vault is now unlocked!', raw='sessionkey')))
+        elif self.path == '/lock':
+            self.respond(200, dict(success=True, data=dict(title='Your vault is locked.')))
+        else:
+            self.respond(400, dict(success=False, message='Invalid master password.'))
+
+    def log_message(self, *args):
+        pass
+
+
+class ServeTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('localhost', 0), StubBwServe)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubBwServe.calls.clear()
+        self.addCleanup(bitwarden._vaults.clear)
+
+    def source(self, **settings):
+        return bitwarden_serve.BitWardenServeAuthSource(port=self.server.server_port, start=False, **settings)
+
+    def api_calls(self):
+        return [ c for c in StubBwServe.calls if c[1] != '/status' ]
+
+    def test_get(self):
+        with self.source(cache_ttl=0).unlock('master') as source:
+            self.assertEqual(source.get_auth_info('item1'), dict(username='user1', password='pass1'))
+            self.assertIsNone(source.get_item('nope'))
+        self.assertEqual(self.api_calls(), [('POST', '/unlock'), ('GET', '/object/item/item1'), ('GET', '/object/item/nope'), ('POST', '/lock')])
+
+    def test_batch_and_cache(self):
+        for _ in range(2):
+            with self.source().unlock('master') as source:
+                infos = source.get_auth_infos(['item0', 'item2'])
+        self.assertEqual(infos, [dict(username='user0', password='pass0'), dict(username='user2', password='pass2')])
+        self.assertEqual(self.api_calls(), [('POST', '/unlock'), ('GET', '/list/object/items')])
+
+    def test_wrong_password(self):
+        self.assertRaises(AuthError, self.source().unlock, 'wrong')
+
+    def test_not_running(self):
+        source = bitwarden_serve.BitWardenServeAuthSource(port=1, start=False)
+        self.assertRaises(AuthError, source.unlock, 'master')
+
+    def test_status_timeout(self):
+        source = bitwarden_serve.BitWardenServeAuthSource(port=2, start=False)
+        with mock.patch.object(source._http, 'get', side_effect=requests.Timeout):
+            self.assertRaises(AuthError, source.unlock, 'master')
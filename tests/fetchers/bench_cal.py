@@ -0,0 +1,33 @@
+"""
+Time parsing the cal fixtures with fetchers.cal, against BeautifulSoup's html.parser that it used before.
+
+Run from the repository root with:
+    DJANGO_SETTINGS_MODULE=money.settings python -m tests.fetchers.bench_cal
+"""
+import os
+import timeit
+
+import django
+django.setup()
+
+from bs4 import BeautifulSoup
+import fetchers.cal
+
+FIXTURE_DIR = f'{os.path.dirname(__file__)}/fixtures'
+FIXTURES = ['cal_transactions_acc1.html', 'cal_transactions_acc2.html', 'cal_transactions_noresults_acc1.html']
+
+def parse_fixture(html):
+    page = fetchers.cal.parse_page(html)
+    fetchers.cal.parse(page)
+    fetchers.cal.select_card_payload(page, '1234')
+    fetchers.cal.transaction_payload(1, 2021, page)
+
+def main(number=20):
+    for name in FIXTURES:
+        html = open(f'{FIXTURE_DIR}/{name}', 'r').read()
+        soup = timeit.timeit(lambda: BeautifulSoup(html, 'html.parser'), number=number) / number
+        cal = timeit.timeit(lambda: parse_fixture(html), number=number) / number
+        print(f'{name}: html.parser tree only {soup * 1000:.1f}ms, cal parse and payloads {cal * 1000:.1f}ms ({soup / cal:.0f}x)')
+
+if __name__ == '__main__':
+    main()
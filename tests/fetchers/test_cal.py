@@ -3,8 +3,7 @@ import os
 import datetime
 import requests_mock
 import requests
-from unittest import TestCase
-from bs4 import BeautifulSoup
+from unittest import TestCase, mock
 
 import fetchers
 from transactions.models import Account
@@ -15,11 +14,11 @@ FIXTURE_DIR = f'{os.path.dirname(__file__)}/fixtures'
 class ParseTest(TestCase):
     def setUp(self):
         html = open(f'{FIXTURE_DIR}/cal_transactions_acc1.html', 'r').read()
-        self.transaction_page1 = BeautifulSoup(html, 'html.parser')
+        self.transaction_page1 = fetchers.cal.parse_page(html)
         html = open(f'{FIXTURE_DIR}/cal_transactions_acc2.html', 'r').read()
-        self.transaction_page2 = BeautifulSoup(html, 'html.parser')
-        html = open(f'{FIXTURE_DIR}/cal_transactions_noresults_acc1.html', 'r').read()            
-        self.transaction_page_noresults = BeautifulSoup(html, 'html.parser')
+        self.transaction_page2 = fetchers.cal.parse_page(html)
+        html = open(f'{FIXTURE_DIR}/cal_transactions_noresults_acc1.html', 'r').read()
+        self.transaction_page_noresults = fetchers.cal.parse_page(html)
         self.accounts = [
                 Account(backend_id='1234'),
                 Account(backend_id='0345')
@@ -90,6 +89,62 @@ class ParseTest(TestCase):
         self.assert_(t0.original_currency == "ILS")
         self.assert_(t0.notes == '')
 
+    def test_select_date(self):
+        self.assertEqual(fetchers.cal.select_date(1, 2021, self.transaction_page1), (17, '01/2021'))
+        self.assertRaises(RuntimeError, fetchers.cal.select_date, 1, 1990, self.transaction_page1)
+
+    def test_cards_list(self):
+        cards = fetchers.cal.get_cards_list(self.transaction_page1)
+        self.assertEqual([ (c['name'][-5:-1], c['id'], c['idx']) for c in cards ], [('0345', '117933777552020365', 0), ('1234', '33070314445452018280', 1)])
+
+    def test_payloads(self):
+        payload = fetchers.cal.select_card_payload(self.transaction_page1, '1234')
+        self.assertEqual(payload['__EVENTTARGET'], 'ctl00$ContentTop$cboCardList$categoryList$outerRep$ctl00$innerRep$ctl01$lnkItem')
+        self.assertEqual(payload['ctl00$__MATRIX_VIEWSTATE'], '3')
+        payload = fetchers.cal.transaction_payload(12, 2020, self.transaction_page1)
+        self.assertEqual(payload['ctl00$FormAreaNoBorder$FormArea$clndrDebitDateScope$HiddenField'], 16)
+        self.assertEqual(payload['cmbTransOrigin_HiddenField'], ' ')
+
+    def test_page_memoized(self):
+        page = self.transaction_page1
+        fetchers.cal.select_card_payload(page, '1234')
+        inputs, cards = page.inputs, page.cards
+        fetchers.cal.select_card_payload(page, '0345')
+        fetchers.cal.transaction_payload(1, 2021, page)
+        self.assert_(page.inputs is inputs)
+        self.assert_(page.cards is cards)
+
+
+class RangeTest(TestCase):
+    def setUp(self):
+        html = open(f'{FIXTURE_DIR}/cal_transactions_acc1.html', 'r').read()
+        self.calls = []
+        def get_transaction_page(s, data=None, validate=None, post=None):
+            if data is None:
+                self.calls.append('page')
+            elif post is not None:
+                self.calls.append(('card', data['__EVENTTARGET'][-10:-8]))
+                return s
+            else:
+                self.calls.append(('date', data['ctl00$FormAreaNoBorder$FormArea$clndrDebitDateScope$TextBox']))
+            return s, fetchers.cal.parse_page(html)
+        patcher = mock.patch.object(fetchers.cal, 'get_transaction_page', get_transaction_page)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.accounts = [ Account(backend_id='1234'), Account(backend_id='0345') ]
+
+    def test_range(self):
+        transactions = fetchers.cal.get_range_transactions(None, [(12, 2020), (1, 2021)], self.accounts)
+        self.assertEqual(self.calls, ['page',
+            ('card', '01'), ('date', '12/2020'), ('date', '01/2021'),
+            ('card', '00'), ('date', '12/2020'), ('date', '01/2021')])
+        self.assertEqual([ [ t.from_account.backend_id for t in month ] for month in transactions ], [ ['1234'] * 3 + ['0345'] * 3 ] * 2)
+
+    def test_month(self):
+        transactions = fetchers.cal.get_month_transactions(None, 1, 2021, self.accounts[:1])
+        self.assertEqual(self.calls, ['page', ('card', '01'), ('date', '01/2021')])
+        self.assertEqual(len(transactions), 3)
+
 
 @requests_mock.Mocker()
 class LoginTest(TestCase):
@@ -175,3 +230,9 @@ class LoginTest(TestCase):
         self.assertRaisesRegex(fetchers.FetchException, 'login failed', fetchers.cal.login_stage3, s, dict(eventData='data'), 'token')
         
         self.assert_(isinstance(s, requests.Session))
+
+    def test_session_alive(self, m):
+        m.register_uri('HEAD', self.final_url, [ { 'status_code': 200 }, { 'status_code': 302, 'headers': { 'Location': self.stage1_url } } ])
+        self.assertTrue(fetchers.cal.is_session_alive(requests.Session()))
+        self.assertFalse(fetchers.cal.is_session_alive(requests.Session()))
+        self.assertEqual([ r.method for r in m.request_history ], ['HEAD', 'HEAD'])
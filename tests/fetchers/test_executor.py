@@ -0,0 +1,206 @@
+import time
+import threading
+import types
+from unittest import TestCase
+
+import fetchers
+from fetchers import sessions
+
+
+def make_backend(concurrent_months, max_concurrency=4, delay=0.05, fail_on=None):
+    state = dict(running=0, max_running=0, logins=[])
+    lock = threading.Lock()
+
+    def work(result):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        time.sleep(delay)
+        with lock:
+            state['running'] -= 1
+        return result
+
+    def login(user, passwd):
+        state['logins'].append(user)
+        return work(f'session-{user}')
+
+    def get_month_transactions(s, month, year, accounts):
+        if (s, month) == fail_on:
+            raise fetchers.FetchException("failed", response=None)
+        return work([ (s, month, year, a) for a in accounts ])
+
+    backend = types.ModuleType('fake_backend')
+    backend.login = login
+    backend.get_month_transactions = get_month_transactions
+    backend.CONCURRENT_MONTHS = concurrent_months
+    backend.MAX_CONCURRENCY = max_concurrency
+    return backend, state
+
+
+class FetchTest(TestCase):
+    groups = [ (dict(username='u1', password='p'), ['a1', 'a2']), (dict(username='u2', password='p'), ['a3']) ]
+    months = [ (11, 2020), (12, 2020), (1, 2021) ]
+    expected = [
+        ('session-u1', 11, 2020, 'a1'), ('session-u1', 11, 2020, 'a2'),
+        ('session-u1', 12, 2020, 'a1'), ('session-u1', 12, 2020, 'a2'),
+        ('session-u1', 1, 2021, 'a1'), ('session-u1', 1, 2021, 'a2'),
+        ('session-u2', 11, 2020, 'a3'), ('session-u2', 12, 2020, 'a3'), ('session-u2', 1, 2021, 'a3'),
+    ]
+
+    def test_concurrent_months(self):
+        backend, state = make_backend(True)
+        self.assertEqual(fetchers.fetch(backend, self.groups, self.months), self.expected)
+        self.assertEqual(state['max_running'], 4)
+        self.assertEqual(sorted(state['logins']), ['u1', 'u2'])
+
+    def test_sequential_months(self):
+        backend, state = make_backend(False)
+        self.assertEqual(fetchers.fetch(backend, self.groups, self.months), self.expected)
+        self.assertEqual(state['max_running'], 2)
+
+    def test_limit(self):
+        backend, state = make_backend(True, max_concurrency=1, delay=0.01)
+        self.assertEqual(fetchers.fetch(backend, self.groups, self.months), self.expected)
+        self.assertEqual(state['max_running'], 1)
+
+    def test_iter_order(self):
+        backend, _ = make_backend(True)
+        indexes = [ (g, m) for g, m, _ in fetchers.iter_fetch(backend, self.groups, self.months) ]
+        self.assertEqual(indexes, [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)])
+
+    def test_error(self):
+        backend, _ = make_backend(True, fail_on=('session-u2', 12))
+        self.assertRaises(fetchers.FetchException, fetchers.fetch, backend, self.groups, self.months)
+
+
+class SessionPoolTest(TestCase):
+    groups = FetchTest.groups
+    months = FetchTest.months
+
+    def setUp(self):
+        self.pool = sessions.SessionPool()
+        self.addCleanup(self.pool.clear)
+
+    def test_reuse(self):
+        backend, state = make_backend(True, delay=0)
+        first = fetchers.fetch(backend, self.groups, self.months, session_pool=self.pool)
+        second = fetchers.fetch(backend, self.groups, self.months, session_pool=self.pool)
+        self.assertEqual(first, second)
+        self.assertEqual(sorted(state['logins']), ['u1', 'u2'])
+
+    def test_changed_password(self):
+        backend, state = make_backend(True, delay=0)
+        fetchers.fetch(backend, self.groups[:1], self.months, session_pool=self.pool)
+        fetchers.fetch(backend, [ (dict(username='u1', password='new'), ['a1']) ], self.months, session_pool=self.pool)
+        self.assertEqual(state['logins'], ['u1', 'u1'])
+
+    def test_expired(self):
+        backend, state = make_backend(True, delay=0)
+        closed = []
+        backend.SESSION_TTL = 0
+        backend.close_session = closed.append
+        fetchers.fetch(backend, self.groups[:1], self.months, session_pool=self.pool)
+        time.sleep(0.01)
+        fetchers.fetch(backend, self.groups[:1], self.months, session_pool=self.pool)
+        self.assertEqual(state['logins'], ['u1', 'u1'])
+        # Both sessions expire as soon as they're returned
+        self.assertEqual(closed, ['session-u1', 'session-u1'])
+
+    def test_health_check(self):
+        backend, state = make_backend(True, delay=0)
+        backend.is_session_alive = lambda s: False
+        fetchers.fetch(backend, self.groups[:1], self.months, session_pool=self.pool)
+        fetchers.fetch(backend, self.groups[:1], self.months, session_pool=self.pool)
+        self.assertEqual(state['logins'], ['u1', 'u1'])
+
+    def test_relogin_on_failure(self):
+        backend, state = make_backend(False, delay=0)
+        fetchers.fetch(backend, self.groups[:1], self.months, session_pool=self.pool)
+        sessions_seen = []
+        get_month_transactions = backend.get_month_transactions
+        def expiring(s, month, year, accounts):
+            sessions_seen.append(s)
+            if len(sessions_seen) == 1:
+                raise fetchers.FetchException("session expired", response=None)
+            return get_month_transactions(s, month, year, accounts)
+        backend.get_month_transactions = expiring
+        self.assertEqual(len(fetchers.fetch(backend, self.groups[:1], self.months, session_pool=self.pool)), 6)
+        self.assertEqual(state['logins'], ['u1', 'u1'])
+
+    def test_failed_session_not_kept(self):
+        backend, state = make_backend(True, delay=0, fail_on=('session-u1', 12))
+        self.assertRaises(fetchers.FetchException, fetchers.fetch, backend, self.groups[:1], self.months, session_pool=self.pool)
+        backend.get_month_transactions = lambda s, month, year, accounts: []
+        fetchers.fetch(backend, self.groups[:1], self.months, session_pool=self.pool)
+        self.assertEqual(state['logins'], ['u1', 'u1'])
+
+
+class RangeTest(TestCase):
+    def make_range_backend(self, fail_on=None):
+        backend, state = make_backend(False, delay=0)
+        ranges = []
+        def iter_months_transactions(s, months, accounts):
+            ranges.append((s, months))
+            for m, y in months:
+                if (s, m) == fail_on:
+                    raise fetchers.FetchException("session expired", response=None)
+                yield [ (s, m, y, a) for a in accounts ]
+        backend.iter_months_transactions = iter_months_transactions
+        return backend, state, ranges
+
+    def test_range_used(self):
+        backend, state, ranges = self.make_range_backend()
+        self.assertEqual(fetchers.fetch(backend, FetchTest.groups, FetchTest.months, session_pool=sessions.SessionPool()), FetchTest.expected)
+        self.assertEqual(ranges, [('session-u1', FetchTest.months), ('session-u2', FetchTest.months)])
+
+    def test_months_passed_on_as_fetched(self):
+        backend, state, ranges = self.make_range_backend()
+        release = threading.Event()
+        def iter_months_transactions(s, months, accounts):
+            yield [ (s, 11, 2020, a) for a in accounts ]
+            release.wait(5)
+            yield [ (s, 12, 2020, a) for a in accounts ]
+        backend.iter_months_transactions = iter_months_transactions
+        results = fetchers.iter_fetch(backend, FetchTest.groups[:1], FetchTest.months[:2], session_pool=sessions.SessionPool())
+        self.assertEqual(next(results), (0, 0, [('session-u1', 11, 2020, 'a1'), ('session-u1', 11, 2020, 'a2')]))
+        release.set()
+        self.assertEqual(next(results)[:2], (0, 1))
+        self.assertRaises(StopIteration, next, results)
+
+    def test_backpressure(self):
+        backend, state, ranges = self.make_range_backend()
+        months = [ (m, 2020) for m in range(1, 13) ]
+        fetched = []
+        def iter_months_transactions(s, months, accounts):
+            for m, y in months:
+                fetched.append(m)
+                yield []
+        backend.iter_months_transactions = iter_months_transactions
+        results = fetchers.iter_fetch(backend, FetchTest.groups[:1], months, session_pool=sessions.SessionPool())
+        next(results)
+        time.sleep(0.2)
+        # The month taken, the ones waiting for the caller, and the one waiting for room
+        self.assertLessEqual(len(fetched), fetchers.executor.MONTHS_BUFFERED + 2)
+        self.assertEqual(len(list(results)), 11)
+        self.assertEqual(len(fetched), 12)
+
+    def test_stop_while_waiting(self):
+        backend, state, ranges = self.make_range_backend()
+        backend.iter_months_transactions = lambda s, months, accounts: ( [] for _ in months )
+        results = fetchers.iter_fetch(backend, FetchTest.groups[:1], [ (m, 2020) for m in range(1, 13) ], session_pool=sessions.SessionPool())
+        next(results)
+        time.sleep(0.1)
+        # Closing returns once the fetch that waits for room notices
+        results.close()
+
+    def test_retry_resumes(self):
+        pool = sessions.SessionPool()
+        backend, state, ranges = self.make_range_backend(fail_on=('session-u1', 12))
+        iter_months_transactions = backend.iter_months_transactions
+        backend.iter_months_transactions = lambda s, months, accounts: iter([ [] for _ in months ])
+        fetchers.fetch(backend, FetchTest.groups[:1], FetchTest.months, session_pool=pool)
+        backend.iter_months_transactions = iter_months_transactions
+        backend.login = lambda user, passwd: 'session-again'
+        transactions = fetchers.fetch(backend, FetchTest.groups[:1], FetchTest.months, session_pool=pool)
+        self.assertEqual(ranges, [('session-u1', FetchTest.months), ('session-again', FetchTest.months[1:])])
+        self.assertEqual([ t[:2] for t in transactions ], [('session-u1', 11)] * 2 + [('session-again', 12)] * 2 + [('session-again', 1)] * 2)
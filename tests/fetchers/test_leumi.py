@@ -3,7 +3,7 @@ import os
 import datetime
 import requests_mock
 import requests
-from unittest import TestCase
+from unittest import TestCase, mock
 
 import fetchers
 from transactions.models import Account
@@ -143,6 +143,12 @@ class LoginTest(TestCase):
         self.assertEqual(history[1].url, self.auth_url)
         self.assertEqual(history[2].url, self.auth_url)
 
+    def test_session_alive(self, m):
+        url = 'https://hb2.bankleumi.co.il/ebanking/Accounts/ExtendedActivity.aspx?WidgetPar=1'
+        m.register_uri('GET', url, [ { 'text': 'תנועות בחשבון' }, { 'status_code': 302, 'headers': { 'Location': self.auth_url } } ])
+        self.assertTrue(fetchers.leumi.is_session_alive(requests.Session()))
+        self.assertFalse(fetchers.leumi.is_session_alive(requests.Session()))
+
 
 @requests_mock.Mocker()
 class GetRequestsPageTest(TestCase):
@@ -280,3 +286,77 @@ class FetchTest(TestCase):
         self.assertIn('__EVENTVALIDATION=eventvalidation', history[2].text)
         self.assertIn('__VIEWSTATE=viewstate2', history[3].text)
         self.assertIn('__EVENTVALIDATION=eventvalidation2', history[3].text)
+
+
+class RangeTest(TestCase):
+    def setUp(self):
+        dat_bytes = open(f'{FIXTURE_DIR}/Bankin.dat', 'rb').read()
+        self.bankin_dat = list(filter(None, dat_bytes.decode('cp862').split('\r\n')))
+        self.accounts = [
+                Account(backend_id='12345678901234'),
+                Account(backend_id='00000000000123')
+        ]
+        self.months = [ (12, 2019) ] + [ (m, 2020) for m in range(1, 13) ]
+
+    def test_one_export(self):
+        with mock.patch.object(fetchers.leumi, 'fetch_csv_lines', return_value=iter(self.bankin_dat)) as fetch_csv:
+            transactions = fetchers.leumi.get_range_transactions(None, self.months, self.accounts)
+        fetch_csv.assert_called_once_with(None, '01/12/19', '31/12/20')
+        self.assertEqual([ len(month) for month in transactions ], [1] + [0] * 11 + [1])
+        self.assertEqual(transactions[-1][0].transaction_date, datetime.date(2020, 12, 2))
+
+    def test_no_split(self):
+        with mock.patch.object(fetchers.leumi, 'fetch_csv_lines', return_value=iter(self.bankin_dat)):
+            transactions = fetchers.leumi.get_range_transactions(None, self.months, self.accounts, split=False)
+        self.assertEqual([ t.transaction_date for t in transactions ], [datetime.date(2019, 12, 2), datetime.date(2020, 12, 2)])
+
+    def test_months_yielded_as_read(self):
+        read = []
+        bankin_dat = self.bankin_dat + self.bankin_dat[-1:]
+        def lines():
+            for line in bankin_dat:
+                read.append(line)
+                yield line
+        with mock.patch.object(fetchers.leumi, 'fetch_csv_lines', return_value=lines()):
+            months = fetchers.leumi.iter_months_transactions(None, self.months, self.accounts)
+            self.assertEqual(len(next(months)), 1)
+            self.assertLess(len(read), len(bankin_dat))
+            self.assertEqual([ len(month) for month in months ], [0] * 11 + [2])
+
+
+    def test_descending_export(self):
+        with mock.patch.object(fetchers.leumi, 'fetch_csv_lines', return_value=iter(self.bankin_dat[::-1])):
+            transactions = list(fetchers.leumi.iter_months_transactions(None, self.months, self.accounts))
+        self.assertEqual([ len(month) for month in transactions ], [1] + [0] * 11 + [1])
+        self.assertEqual(transactions[0][0].transaction_date, datetime.date(2019, 12, 2))
+
+    def test_interleaved_export(self):
+        bankin_dat = self.bankin_dat + self.bankin_dat[:1]
+        with mock.patch.object(fetchers.leumi, 'fetch_csv_lines', return_value=iter(bankin_dat)):
+            with self.assertWarnsRegex(UserWarning, "isn't sorted by date, 1 transactions"):
+                transactions = list(fetchers.leumi.iter_months_transactions(None, self.months, self.accounts))
+        self.assertEqual([ len(month) for month in transactions ], [1] + [0] * 11 + [2])
+
+
+class StreamTest(TestCase):
+    class Response:
+        def __init__(self, content):
+            self.content = content
+
+        def iter_content(self, chunk_size):
+            # Small chunks, so that lines and line ends are split between them
+            for i in range(0, len(self.content), 7):
+                yield self.content[i:i + 7]
+
+    def test_lines(self):
+        dat_bytes = open(f'{FIXTURE_DIR}/Bankin.dat', 'rb').read()
+        expected = list(filter(None, dat_bytes.decode('cp862').split('\r\n')))
+        self.assertEqual(list(fetchers.leumi.iter_csv_lines(self.Response(dat_bytes))), expected)
+        self.assertEqual(list(fetchers.leumi.iter_csv_lines(self.Response(dat_bytes.rstrip(b'\r\n')))), expected)
+
+    def test_transactions(self):
+        accounts = [ Account(backend_id='12345678901234'), Account(backend_id='00000000000123') ]
+        dat_bytes = open(f'{FIXTURE_DIR}/Bankin.dat', 'rb').read()
+        transactions = fetchers.leumi.iter_bankin_dat(accounts, fetchers.leumi.iter_csv_lines(self.Response(dat_bytes)))
+        self.assertEqual(next(transactions).confirmation, 13715)
+        self.assertEqual(len(list(transactions)), 1)
@@ -1,6 +1,7 @@
 import sys
 import os
 import datetime
+import warnings
 import requests_mock
 import requests
 from unittest import TestCase
@@ -84,6 +85,16 @@ class ParseTest(TestCase):
         self.assert_(t0.confirmation is None)
         self.assert_(t0.notes == self.raw_transactions[1]['comments'])
 
+    def test_skipped_reported(self):
+        raw_transactions = self.raw_transactions + [ dict(self.raw_transactions[0], shortCardNumber='9999'), dict(shortCardNumber='1234') ]
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            transactions = fetchers.leumicard.parse_transactions(self.accounts[:1], raw_transactions)
+        self.assertEqual(len(transactions), 1)
+        self.assertEqual([ str(w.message) for w in caught ], [
+            'leumicard: skipped 2 transactions of unknown accounts: 0000 (1), 9999 (1)',
+            'leumicard: skipped 1 malformed transactions'])
+
 
 @requests_mock.Mocker()
 class LoginTest(TestCase):
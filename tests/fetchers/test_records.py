@@ -0,0 +1,40 @@
+import sys
+import datetime
+import subprocess
+from unittest import TestCase
+
+from fetchers import FetchedTransaction
+from transactions.models import Account, Category, Transaction
+from transactions.serializers import TransactionSerializer
+
+
+class RecordTest(TestCase):
+    def setUp(self):
+        self.account = Account(name='acc', backend_id='1234')
+        self.transactions = [
+            FetchedTransaction(from_account=self.account, transaction_date=datetime.date(2021, 1, 2), bill_date=datetime.date(2021, 2, 10),
+                               transaction_amount=19.9, billed_amount=19.9, original_currency='ILS', description='SpotifyIL',
+                               notes='', confirmation=123, category=Category(title='music')),
+            FetchedTransaction(to_account=self.account, transaction_date=datetime.date(2021, 1, 3), bill_date=datetime.date(2021, 1, 3),
+                               transaction_amount=-12.345, billed_amount=None, description='dana'),
+        ]
+
+    def test_to_dict(self):
+        for t in self.transactions:
+            self.assertEqual(t.to_dict(), TransactionSerializer(t.to_model()).data)
+
+    def test_datetime_dates(self):
+        t = FetchedTransaction(to_account=self.account, transaction_date=datetime.datetime(2021, 1, 1), bill_date=datetime.datetime(2021, 1, 1), transaction_amount=10)
+        self.assertEqual(t.to_dict()['transaction_date'], '2021-01-01')
+
+    def test_to_model(self):
+        t = self.transactions[0].to_model()
+        self.assertIsInstance(t, Transaction)
+        self.assertEqual((t.from_account, t.description, t.category.title), (self.account, 'SpotifyIL', 'music'))
+
+    def test_slots(self):
+        self.assertRaises(AttributeError, setattr, self.transactions[0], 'other', 1)
+
+    def test_import_without_django(self):
+        code = "import sys, fetchers; assert not [ m for m in sys.modules if m.split('.')[0] in ('django', 'transactions') ]"
+        subprocess.run([sys.executable, '-c', code], check=True, env={})
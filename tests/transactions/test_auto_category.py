@@ -1,8 +1,8 @@
-from unittest import TestCase
+from unittest import TestCase, mock
 import datetime
 
 import transactions.auto_category as ac
-from transactions.models import Transaction, Account
+from transactions.models import Transaction, Account, Category, Pattern
 
 
 class RunRuleTest(TestCase):
@@ -121,3 +121,134 @@ class RunRuleTest(TestCase):
         self.assertTrue(ac.run_rule(self.t1, rule1))
         self.assertTrue(ac.run_rule(self.t2, rule1))
         self.assertFalse(ac.run_rule(self.t3, rule1))
+
+
+class CompileRuleTest(TestCase):
+    def setUp(self):
+        self.account = Account(name='acc1')
+        self.category1 = Category(title='cat1')
+        self.category2 = Category(title='cat2')
+        self.t1 = Transaction(from_account=self.account, transaction_date=datetime.date(2020, 1, 1), bill_date=datetime.date(2020, 2, 2), billed_amount=12, transaction_amount=12, original_currency="ILS", description="test")
+        self.t2 = Transaction(to_account=self.account, transaction_date=datetime.date(2020, 1, 1), bill_date=datetime.date(2020, 2, 2), billed_amount=12, transaction_amount=12, original_currency="ILS", description="test 2")
+
+    def test_compile(self):
+        predicate = ac.compile_rule({'or': [ dict(field="description", regex="2$"), dict(field="from_account", isnull=False) ]})
+        self.assertTrue(predicate(self.t1))
+        self.assertTrue(predicate(self.t2))
+        predicate = ac.compile_rule({'not': dict(field="transaction_date$day", eq="1")})
+        self.assertFalse(predicate(self.t1))
+
+    def test_cached(self):
+        p = Pattern(id=1001, name='p1', matcher=dict(field="description", eq="test"), target_category=self.category1)
+        self.assertIs(ac.get_predicate(p), ac.get_predicate(p))
+        with mock.patch.object(ac, '_stamp') as stamp:
+            ac.get_predicate(p)
+            ac.categorize([p], self.t1)
+        stamp.assert_not_called()
+        # A new object of the same pattern reuses the compiled predicate
+        self.assertIs(ac.get_predicate(Pattern(id=1001, matcher=dict(p.matcher))), ac.get_predicate(p))
+
+    def test_cache_invalidated_on_change(self):
+        p = Pattern(id=1002, name='p1', matcher=dict(field="description", eq="test"), target_category=self.category1)
+        self.assertTrue(ac.get_predicate(p)(self.t1))
+        p.matcher = dict(field="description", eq="test 2")
+        self.assertFalse(ac.get_predicate(p)(self.t1))
+        self.assertTrue(ac.get_predicate(p)(self.t2))
+
+    def test_categorize(self):
+        rules = [
+            Pattern(id=1003, name='p1', matcher=dict(field="description", regex="2$"), target_category=self.category1),
+            Pattern(id=1004, name='p2', matcher=dict(field="billed_amount", eq="12"), target_category=self.category2),
+        ]
+        self.assertIs(ac.categorize(rules, self.t1), self.category2)
+        self.assertIs(ac.categorize(rules, self.t2), self.category1)
+        self.assertIsNone(ac.categorize(rules[:1], self.t1))
+
+
+class CategorizeManyTest(TestCase):
+    def setUp(self):
+        self.account = Account(name='acc1')
+        self.categories = [ Category(title=f'cat{i}') for i in range(3) ]
+        self.transactions = [
+            Transaction(from_account=self.account, transaction_date=datetime.date(2020, 1, 1), bill_date=datetime.date(2020, 2, 2), billed_amount=12, transaction_amount=12, original_currency="ILS", description="test"),
+            Transaction(to_account=self.account, transaction_date=datetime.date(2020, 1, 1), bill_date=datetime.date(2020, 2, 2), billed_amount=12, transaction_amount=12, original_currency="ILS", description="test 2"),
+            Transaction(to_account=self.account, transaction_date=datetime.date(2020, 1, 3), bill_date=datetime.date(2020, 2, 2), billed_amount=13, transaction_amount=12, original_currency="USD", description="test 3"),
+            Transaction(from_account=self.account, transaction_date=datetime.date(2020, 1, 4), bill_date=datetime.date(2020, 2, 2), billed_amount=100, transaction_amount=100, original_currency="ILS", description="other"),
+        ]
+        self.rules = [
+            Pattern(id=2001, name='p1', target_category=self.categories[0], matcher={'and': [
+                dict(field="description", regex="^test"), {'not': dict(field="to_account", isnull=True)} ]}),
+            Pattern(id=2002, name='p2', target_category=self.categories[1], matcher={'or': [
+                dict(field="original_currency", eq="USD"), dict(field="billed_amount", le=12, gt=10) ]}),
+            Pattern(id=2003, name='p3', target_category=self.categories[2], matcher=dict(field="transaction_date$day", ge=4)),
+        ]
+
+    def test_same_as_categorize(self):
+        expected = [ ac.categorize(self.rules, t) for t in self.transactions ]
+        self.assertEqual(ac.categorize_many(self.rules, self.transactions), expected)
+        self.assertEqual(expected, [self.categories[1], self.categories[0], self.categories[0], self.categories[2]])
+
+    def test_no_match(self):
+        self.assertEqual(ac.categorize_many(self.rules[2:], self.transactions), [None, None, None, self.categories[2]])
+
+    def test_empty(self):
+        self.assertEqual(ac.categorize_many(self.rules, []), [])
+        self.assertEqual(ac.categorize_many([], self.transactions), [None] * 4)
+
+
+class RuleIndexTest(TestCase):
+    def setUp(self):
+        self.account = Account(name='acc1')
+        self.category = Category(title='cat')
+        make = lambda d, notes=None: Transaction(from_account=self.account, transaction_date=datetime.date(2020, 1, 1), bill_date=datetime.date(2020, 2, 2), billed_amount=12, transaction_amount=12, original_currency="ILS", description=d, notes=notes)
+        self.transactions = [ make("SPOTIFY IL"), make("Super market"), make("test", notes="bus ride"), make("other") ]
+
+    def test_required_literal(self):
+        self.assertEqual(ac._required_literal("SPOTIFY"), "SPOTIFY")
+        self.assertEqual(ac._required_literal("^super mar?ket$"), "super ma")
+        self.assertEqual(ac._required_literal(r"foo\.ba+r"), "foo.ba")
+        self.assertEqual(ac._required_literal(r"(a|b)ccc[de]f{2,3}"), "ccc")
+        self.assertEqual(ac._required_literal(r"\d+ abc"), " abc")
+        self.assertIsNone(ac._required_literal("foo|bar"))
+        self.assertIsNone(ac._required_literal("(?i)foo"))
+        self.assertIsNone(ac._required_literal(".*"))
+        self.assertIsNone(ac._required_literal(r"\u05e9\u05d5\U0001F600"))
+        self.assertEqual(ac._required_literal(r"\x41BC"), "BC")
+        self.assertEqual(ac._required_literal(r"\101BC"), "BC")
+        self.assertEqual(ac._required_literal(r"\N{HEBREW LETTER SHIN}ufersal"), "ufersal")
+
+    def test_escapes_match_run_rule(self):
+        make = lambda d: Transaction(from_account=self.account, transaction_date=datetime.date(2020, 1, 1), bill_date=datetime.date(2020, 2, 2), billed_amount=12, transaction_amount=12, original_currency="ILS", description=d)
+        transactions = [ make("שופרסל דיל"), make("ABC store"), make("other 05") ]
+        matchers = [ r"\u05e9\u05d5\u05e4", r"\x41BC", r"\101BC", r"\N{HEBREW LETTER SHIN}", r"\d\d$" ]
+        for i, regex in enumerate(matchers):
+            rules = [ Pattern(id=3100 + i, name=f'e{i}', matcher=dict(field="description", regex=regex), target_category=self.category) ]
+            expected = [ self.category if ac.run_rule(t, rules[0].matcher) else None for t in transactions ]
+            self.assertTrue(any(expected), regex)
+            self.assertEqual([ ac.categorize(rules, t) for t in transactions ], expected, regex)
+            self.assertEqual(ac.categorize_many(rules, transactions), expected, regex)
+
+    def test_automaton(self):
+        automaton = ac._Automaton(["he", "she", "hers", "his"])
+        self.assertEqual(automaton.find("ushers"), {"he", "she", "hers"})
+        self.assertEqual(automaton.find("hi"), set())
+
+    def test_candidates(self):
+        index = ac.RuleIndex([
+            dict(field="description", regex="^SPOTIFY"),
+            {'and': [ dict(field="billed_amount", gt=10), dict(field="description", regex="market") ]},
+            {'or': [ dict(field="description", eq="test"), dict(field="notes", regex="bus") ]},
+            dict(field="billed_amount", gt=10),
+            {'not': dict(field="description", regex="market")},
+        ])
+        self.assertEqual([ index.candidates(t) for t in self.transactions ], [[0, 3, 4], [1, 3, 4], [2, 3, 4], [3, 4]])
+
+    def test_categorize_with_index(self):
+        rules = [
+            Pattern(id=3001, name='p1', matcher=dict(field="description", regex="(?i)super"), target_category=Category(title='c1')),
+            Pattern(id=3002, name='p2', matcher=dict(field="notes", regex="ride$"), target_category=Category(title='c2')),
+            Pattern(id=3003, name='p3', matcher=dict(field="description", regex="S.*IL"), target_category=Category(title='c3')),
+        ]
+        expected = [rules[2].target_category, rules[0].target_category, rules[1].target_category, None]
+        self.assertEqual([ ac.categorize(rules, t) for t in self.transactions ], expected)
+        self.assertEqual(ac.categorize_many(rules, self.transactions), expected)
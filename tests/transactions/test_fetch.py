@@ -0,0 +1,204 @@
+import datetime
+import json
+import types
+from unittest import mock
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+import fetchers
+import auth_sources
+from auth_sources.base import AuthSource as BaseAuthSource
+from transactions import jobs, ingest
+from transactions.models import Transaction, Account, AuthSource, Category, Pattern, FetchJob, AccountSyncState
+from fetchers import FetchedTransaction
+
+
+class FakeAuthSource(BaseAuthSource):
+    def __init__(self, **settings):
+        pass
+
+    def unlock(self, password):
+        return self
+
+    def get_auth_info(self, item_id):
+        return dict(username=item_id, password='secret')
+
+
+def fake_get_month_transactions(s, month, year, accounts):
+    return [ FetchedTransaction(from_account=a, transaction_date=datetime.date(year, month, 1), bill_date=datetime.date(year, month, 10),
+                         transaction_amount=10, billed_amount=10, original_currency='ILS', description=f'{s} {a.backend_id} {month}')
+             for a in accounts ]
+
+fake_backend = types.ModuleType('fake_backend')
+fake_backend.login = lambda user, passwd: f'session-{user}'
+fake_backend.get_month_transactions = fake_get_month_transactions
+fake_backend.CONCURRENT_MONTHS = True
+
+
+class FetchTestMixin:
+    def setUp(self):
+        patchers = [
+            mock.patch.dict(fetchers.BACKENDS, fake=fake_backend),
+            mock.patch.dict(auth_sources.BACKENDS, fake=FakeAuthSource),
+        ]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+        self.client = APIClient()
+        AuthSource.objects.create(name='fake', auth_type='fake', settings={})
+        self.account1 = Account.objects.create(name='acc1', backend_id='1', backend_type='fake', auth_source_item_id='item1')
+        self.account2 = Account.objects.create(name='acc2', backend_id='2', backend_type='fake', auth_source_item_id='item2')
+        self.food = Category.objects.create(title='food')
+        Pattern.objects.create(name='acc2', matcher=dict(field='from_account', eq='acc2'), target_category=self.food, enabled=True)
+
+    params = dict(month=12, year=2020, end_month=1, end_year=2021)
+    expected = ['session-item1 1 12', 'session-item1 1 1', 'session-item2 2 12', 'session-item2 2 1']
+
+
+class FetchViewTest(FetchTestMixin, TestCase):
+    def test_fetch(self):
+        response = self.client.post('/fetch/fake', { **self.params, 'pass': 'p' }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([ t['description'] for t in response.data ], self.expected)
+        self.assertEqual([ t['category'] for t in response.data ], [None, None, 'food', 'food'])
+
+    def test_disabled_patterns(self):
+        Pattern.objects.create(name='acc1', matcher=dict(field='from_account', eq='acc1'), target_category=self.food)
+        response = self.client.post('/fetch/fake', { **self.params, 'pass': 'p' }, format='json')
+        self.assertEqual([ t['category'] for t in response.data ], [None, None, 'food', 'food'])
+
+    def test_errors(self):
+        self.assertEqual(self.client.post('/fetch/nope', dict(self.params, **{'pass': 'p'}), format='json').status_code, 404)
+        self.assertEqual(self.client.post('/fetch/fake', self.params, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/fetch/fake', dict(self.params, month=13, **{'pass': 'p'}), format='json').status_code, 400)
+
+    def test_store(self):
+        response = self.client.post('/fetch/fake', { **self.params, 'pass': 'p', 'store': True }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['fetched'], response.data['inserted'], response.data['skipped']), (4, 4, 0))
+        stored = Transaction.objects.filter(pk__in=response.data['ids']).order_by('pk')
+        self.assertEqual([ t.description for t in stored ], self.expected)
+        self.assertEqual([ t.category for t in stored ], [None, None, self.food, self.food])
+
+        response = self.client.post('/fetch/fake', { **self.params, 'pass': 'p', 'store': True }, format='json')
+        self.assertEqual((response.data['fetched'], response.data['inserted'], response.data['skipped']), (4, 0, 4))
+        self.assertEqual(response.data['ids'], [])
+        self.assertEqual(Transaction.objects.count(), 4)
+
+    def test_store_and_stream(self):
+        response = self.client.post('/fetch/fake', { **self.params, 'pass': 'p', 'store': True, 'stream': True }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+
+@override_settings(SYNC_OVERLAP_MONTHS=1)
+class SyncTest(FetchTestMixin, TestCase):
+    def store(self, **params):
+        return self.client.post('/fetch/fake', { **self.params, 'pass': 'p', 'store': True, **params }, format='json').data
+
+    def test_state(self):
+        self.store()
+        state = AccountSyncState.objects.get(account=self.account1)
+        self.assertEqual(state.last_transaction_date, datetime.date(2021, 1, 1))
+        self.assertEqual(state.last_bill_date, datetime.date(2021, 1, 10))
+        self.assertEqual(sorted(state.month_hashes), ['2020-12', '2021-01'])
+
+    def test_since_last_sync(self):
+        self.store()
+        response = self.client.post('/fetch/fake', dict(month=1, year=2020, end_month=2, end_year=2021, since_last_sync=True, **{'pass': 'p'}), format='json')
+        self.assertEqual([ t['description'] for t in response.data ], [
+            'session-item1 1 12', 'session-item1 1 1', 'session-item1 1 2', 'session-item2 2 12', 'session-item2 2 1', 'session-item2 2 2'])
+
+    def test_since_last_sync_default(self):
+        self.store()
+        today = datetime.date.today()
+        response = self.client.post('/fetch/fake', dict(since_last_sync=True, **{'pass': 'p'}), format='json')
+        months = [ t['description'].split()[-1] for t in response.data if t['description'].startswith('session-item1') ]
+        # From the month before the last synced transaction, of January 2021, to the current month
+        self.assertEqual(len(months), (today.year - 2020) * 12 + today.month - 12 + 1)
+        self.assertEqual(months[:3], ['12', '1', '2'])
+        self.assertEqual(months[-1], str(today.month))
+
+    def test_since_last_sync_never_synced(self):
+        response = self.client.post('/fetch/fake', dict(month=11, year=2020, end_month=12, end_year=2020, since_last_sync=True, **{'pass': 'p'}), format='json')
+        self.assertEqual(len(response.data), 4)
+
+    def test_unchanged_months_not_written(self):
+        self.store()
+        with mock.patch('transactions.ingest.bulk_insert', wraps=ingest.bulk_insert) as bulk_insert:
+            result = self.store(end_month=2)
+        self.assertEqual(len(bulk_insert.call_args.args[0]), 2)
+        self.assertEqual((result['fetched'], result['inserted'], result['skipped']), (6, 2, 4))
+
+    def test_deleted_rows_restored(self):
+        self.store()
+        Transaction.objects.filter(transaction_date__month=12).delete()
+        result = self.store(end_month=2)
+        self.assertEqual((result['fetched'], result['inserted'], result['skipped']), (6, 4, 2))
+        self.assertEqual(sorted(Transaction.objects.values_list('transaction_date__month', flat=True)), [1, 1, 2, 2, 12, 12])
+
+    def test_unstored_month_not_recorded(self):
+        not_written = lambda transactions: ([], { i: ingest.NOT_WRITTEN_MESSAGE for i in range(len(transactions)) })
+        with mock.patch('transactions.ingest.bulk_insert', side_effect=not_written):
+            self.store()
+        self.assertEqual(AccountSyncState.objects.get(account=self.account1).month_hashes, {})
+        result = self.store()
+        self.assertEqual(result['inserted'], 4)
+
+
+class FetchJobTest(FetchTestMixin, TransactionTestCase):
+    def test_job(self):
+        response = self.client.post('/fetch_jobs/', { **self.params, 'backend': 'fake', 'pass': 'p' }, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertNotIn('pass', response.data['params'])
+        job_id = response.data['id']
+        jobs.wait(job_id, timeout=10)
+
+        response = self.client.get(f'/fetch_jobs/{job_id}/')
+        self.assertEqual(response.data['status'], FetchJob.DONE)
+        self.assertEqual(response.data['months_done'], 4)
+        self.assertEqual(response.data['months_total'], 4)
+        self.assertEqual(response.data['rows_found'], 4)
+
+        response = self.client.get(f'/fetch_jobs/{job_id}/result/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([ t['description'] for t in response.data ], self.expected)
+
+    def test_bad_job(self):
+        self.assertEqual(self.client.post('/fetch_jobs/', { **self.params, 'backend': 'nope', 'pass': 'p' }, format='json').status_code, 404)
+        self.assertEqual(self.client.post('/fetch_jobs/', self.params, format='json').status_code, 400)
+        self.assertEqual(FetchJob.objects.count(), 0)
+
+    def test_stale_job(self):
+        now = timezone.now()
+        stale = FetchJob.objects.create(backend='fake', status=FetchJob.RUNNING, owner='other:1', heartbeat=now - datetime.timedelta(hours=1))
+        live = FetchJob.objects.create(backend='fake', status=FetchJob.RUNNING, owner='other:2', heartbeat=now)
+        # Reading jobs doesn't change them
+        self.assertEqual(self.client.get(f'/fetch_jobs/{stale.pk}/').data['status'], FetchJob.RUNNING)
+        self.assertEqual(jobs.fail_stale(), 1)
+        self.assertEqual(FetchJob.objects.get(pk=stale.pk).error, 'The fetch was interrupted')
+        self.assertEqual(FetchJob.objects.get(pk=live.pk).status, FetchJob.RUNNING)
+
+
+class FetchStreamTest(FetchTestMixin, TestCase):
+    def test_stream(self):
+        response = self.client.post('/fetch/fake', { **self.params, 'pass': 'p', 'stream': True }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [ json.loads(l) for l in b''.join(response.streaming_content).splitlines() ]
+        self.assertEqual([ (l['accounts'], l['month'], l['year']) for l in lines ], [
+            (['acc1'], 12, 2020), (['acc1'], 1, 2021), (['acc2'], 12, 2020), (['acc2'], 1, 2021)])
+        self.assertEqual([ t['description'] for l in lines for t in l['transactions'] ], self.expected)
+        self.assertEqual(lines[3]['transactions'][0]['category'], 'food')
+
+    def test_stream_error(self):
+        def fail(s, month, year, accounts):
+            if month == 1:
+                raise fetchers.FetchException('failed', response=None)
+            return fake_get_month_transactions(s, month, year, accounts)
+        with mock.patch.object(fake_backend, 'get_month_transactions', fail):
+            response = self.client.post('/fetch/fake', { **self.params, 'pass': 'p', 'stream': True }, format='json')
+            lines = [ json.loads(l) for l in b''.join(response.streaming_content).splitlines() ]
+        self.assertEqual(lines[0]['month'], 12)
+        self.assertIn('error', lines[-1])
@@ -0,0 +1,76 @@
+import datetime
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from transactions.models import Transaction, Account, Category
+
+
+class BulkCreateTest(TestCase):
+    url = '/transactions/?bulk=true'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.account = Account.objects.create(name='acc1', backend_id='1', backend_type='cal')
+        self.other_account = Account.objects.create(name='acc2', backend_id='2', backend_type='cal')
+        Category.objects.create(title='food')
+        self.existing = Transaction.objects.create(from_account=self.account, transaction_date=datetime.date(2021, 1, 1), bill_date=datetime.date(2021, 2, 2), billed_amount=10, transaction_amount=10, description="existing")
+
+    def transaction(self, description, amount=10, day=1, **kwargs):
+        return { **dict(transaction_date=f'2021-01-{day:02d}', bill_date='2021-02-02', from_account='acc1', to_account=None, transaction_amount=amount, billed_amount=amount, description=description, category=None, original_currency='ILS', confirmation=None, notes=None), **kwargs }
+
+    def test_bulk_create(self):
+        data = [
+            self.transaction("existing"),
+            self.transaction("new", category='food'),
+            self.transaction("new"),
+            self.transaction("existing", amount=11),
+            { **self.transaction("existing"), 'to_account': 'acc2' },
+            { **self.transaction("no amount"), 'billed_amount': None },
+        ]
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['message'], 'partial_write')
+        self.assertEqual(set(response.data['errors']), {0, 2})
+        self.assertIn('create', response.data['errors'][0])
+        written = response.data['written']
+        self.assertEqual([ (w['description'], w['billed_amount']) for w in written ], [("new", 10), ("existing", 11), ("existing", 10), ("no amount", None)])
+        self.assertEqual(written[0]['category'], 'food')
+        for w in written:
+            self.assertEqual(Transaction.objects.get(pk=w['id']).description, w['description'])
+        self.assertEqual(Transaction.objects.count(), 5)
+
+    def test_bulk_create_all_written(self):
+        response = self.client.post(self.url, [ self.transaction("a"), self.transaction("b", day=2) ], format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['message'], 'ok')
+        self.assertEqual(len(response.data['written']), 2)
+
+    def test_bulk_create_bad_slug(self):
+        response = self.client.post(self.url, [ self.transaction("a"), { **self.transaction("b"), 'from_account': 'nope' } ], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'failed_validation')
+        self.assertEqual(list(response.data['errors']), [1])
+        self.assertIn('from_account', response.data['errors'][1])
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_bulk_create_unhashable_slug(self):
+        response = self.client.post(self.url, [ self.transaction("a"), { **self.transaction("b"), 'from_account': ['acc1'], 'category': {'title': 'food'} } ], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data['errors']), [1])
+        self.assertIn('from_account', response.data['errors'][1])
+
+    def test_slugs_prefetched(self):
+        def count_queries(n):
+            data = [ self.transaction(f"t{n}-{i}", category='food') for i in range(n) ]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, data, format='json')
+            self.assertEqual(len(response.data['written']), n)
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(20))
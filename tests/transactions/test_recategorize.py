@@ -0,0 +1,101 @@
+import datetime
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+import transactions.auto_category as ac
+from transactions.models import Transaction, Account, Category, Pattern
+
+
+class RecategorizeTest(TestCase):
+    url = '/transactions/recategorize/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.account = Account.objects.create(name='acc1', backend_id='1', backend_type='cal')
+        self.food = Category.objects.create(title='food')
+        self.music = Category.objects.create(title='music')
+        self.other = Category.objects.create(title='other')
+        make = lambda day, amount, description, **kwargs: Transaction.objects.create(from_account=self.account, transaction_date=datetime.date(2021, 1, day), bill_date=datetime.date(2021, 2, 2), billed_amount=amount, transaction_amount=amount, original_currency="ILS", description=description, **kwargs)
+        self.t1 = make(1, 10, "SUPER market")
+        self.t2 = make(2, 20, "Spotify", notes="monthly")
+        self.t3 = make(3, 30, "SUPER deli", category=self.other)
+        self.t4 = make(4, 40, "unknown")
+
+    def categories(self):
+        return [ Transaction.objects.get(pk=t.pk).category for t in [self.t1, self.t2, self.t3, self.t4] ]
+
+    def test_split_rule(self):
+        rules = [
+            dict(field="description", regex="^SUPER"),
+            dict(field="notes", regex="one"),
+            dict(field="billed_amount", eq="20"),
+            {'and': [ dict(field="transaction_date$day", ge=2), dict(field="description", eq="Spotify") ]},
+            {'and': [ dict(field="billed_amount", le=30), dict(field="billed_amount", eq="10.000") ]},
+            {'or': [ dict(field="to_account", isnull=False), {'not': dict(field="from_account", eq="acc1")} ]},
+            {'not': dict(field="notes", isnull=False)},
+        ]
+        for rule in rules:
+            q, residual = ac.split_rule(rule)
+            predicate = ac.compile_rule(residual) if residual is not None else lambda t: True
+            expected = [ t.pk for t in Transaction.objects.order_by('pk') if ac.run_rule(t, rule) ]
+            got = [ t.pk for t in Transaction.objects.filter(q).order_by('pk') if predicate(t) ]
+            self.assertEqual(got, expected, rule)
+        self.assertIsNone(ac.split_rule(rules[0])[1])
+        self.assertEqual(ac.split_rule(rules[4])[1], dict(field="billed_amount", eq="10.000"))
+
+    def test_recategorize_all(self):
+        Pattern.objects.create(name='super', matcher=dict(field="description", regex="^SUPER"), target_category=self.food, enabled=True)
+        Pattern.objects.create(name='deli', matcher=dict(field="description", regex="deli"), target_category=self.music, enabled=True)
+        Pattern.objects.create(name='amount', matcher={'or': [ dict(field="billed_amount", eq="20.000"), dict(field="notes", regex="month") ]}, target_category=self.music, enabled=True)
+        Pattern.objects.create(name='disabled', matcher=dict(field="description", regex="unknown"), target_category=self.music)
+
+        response = self.client.post(self.url, {}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], {'super': 2, 'deli': 0, 'amount': 1})
+        self.assertEqual(self.categories(), [self.food, self.music, self.food, None])
+
+    def test_first_rule_wins(self):
+        # Evaluated in Python, then by the database, then in Python again
+        Pattern.objects.create(name='amount', matcher=dict(field="billed_amount", eq="20.000"), target_category=self.music, enabled=True)
+        Pattern.objects.create(name='any', matcher=dict(field="billed_amount", ge=20), target_category=self.food, enabled=True)
+        Pattern.objects.create(name='unknown', matcher=dict(field="transaction_amount", eq="40.000"), target_category=self.other, enabled=True)
+
+        response = self.client.post(self.url, {}, format='json')
+
+        self.assertEqual(response.data['updated'], {'amount': 1, 'any': 2, 'unknown': 0})
+        self.assertEqual(self.categories(), [None, self.music, self.food, self.food])
+
+    def test_joined_fields(self):
+        Pattern.objects.create(name='amount', matcher=dict(field="billed_amount", eq="20.000"), target_category=self.music, enabled=True)
+        Pattern.objects.create(name='super', matcher=dict(field="description", regex="^SUPER"), target_category=self.other, enabled=True)
+        Pattern.objects.create(name='account', matcher=dict(field="from_account", eq="acc1"), target_category=self.food, enabled=True)
+
+        # One scan for the residual, one count and one UPDATE for the rest, one UPDATE of the residual's ids
+        with self.assertNumQueries(9):
+            response = self.client.post(self.url, dict(only_uncategorized=True), format='json')
+
+        self.assertEqual(response.data['updated'], {'amount': 1, 'super': 1, 'account': 1})
+        self.assertEqual(self.categories(), [self.other, self.music, self.other, self.food])
+
+    def test_only_uncategorized(self):
+        Pattern.objects.create(name='super', matcher=dict(field="description", regex="^SUPER"), target_category=self.food, enabled=True)
+        Pattern.objects.create(name='any', matcher=dict(field="billed_amount", gt=0), target_category=self.music, enabled=True)
+
+        response = self.client.post(self.url, dict(only_uncategorized=True), format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], {'super': 1, 'any': 2})
+        self.assertEqual(self.categories(), [self.food, self.music, self.other, self.music])
+
+    def test_date_range(self):
+        Pattern.objects.create(name='any', matcher=dict(field="billed_amount", gt=0), target_category=self.music, enabled=True)
+
+        response = self.client.post(self.url, {'from': '2021-01-02', 'to': '2021-01-04'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.categories(), [None, self.music, self.music, None])
+
+    def test_bad_date(self):
+        response = self.client.post(self.url, {'from': 'yesterday'}, format='json')
+        self.assertEqual(response.status_code, 400)
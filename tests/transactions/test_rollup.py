@@ -0,0 +1,102 @@
+import datetime
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from transactions import rollup
+from transactions.models import Transaction, Account, Category, Pattern, MonthlyRollup, RollupState
+
+
+class RollupTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.account = Account.objects.create(name='acc1', backend_id='1', backend_type='cal')
+        self.food = Category.objects.create(title='food')
+        rollup.rebuild()
+        self.t1 = self.make(datetime.date(2021, 1, 1), 10, 't1')
+        self.t2 = self.make(datetime.date(2021, 1, 20), 20, 't2', category=self.food)
+        self.t3 = self.make(datetime.date(2021, 2, 3), 40, 't3')
+
+    def make(self, date, amount, description, **kwargs):
+        return Transaction.objects.create(from_account=self.account, transaction_date=date, bill_date=date, billed_amount=amount,
+                                          transaction_amount=amount, original_currency='ILS', description=description, **kwargs)
+
+    def rollup_rows(self):
+        return [ (r.month, r.category_id, r.total, r.count) for r in MonthlyRollup.objects.order_by('month', 'category', 'total') ]
+
+    def test_create(self):
+        self.assertEqual(self.rollup_rows(), [
+            (datetime.date(2021, 1, 1), None, 10, 1),
+            (datetime.date(2021, 1, 1), self.food.pk, 20, 1),
+            (datetime.date(2021, 2, 1), None, 40, 1),
+        ])
+        self.assertEqual(rollup.verify(), [])
+
+    def test_update_and_delete(self):
+        self.t1.category = self.food
+        self.t1.save()
+        self.t3.transaction_date = datetime.date(2021, 1, 5)
+        self.t3.save()
+        self.t2.delete()
+        self.assertEqual(self.rollup_rows(), [
+            (datetime.date(2021, 1, 1), None, 40, 1),
+            (datetime.date(2021, 1, 1), self.food.pk, 10, 1),
+        ])
+        self.assertEqual(rollup.verify(), [])
+
+    def test_deltas(self):
+        with mock.patch.object(rollup, 'refresh_buckets', wraps=rollup.refresh_buckets) as refresh_buckets:
+            t4 = self.make(datetime.date(2021, 2, 10), 30, 't4')
+            t5 = self.make(datetime.date(2021, 2, 11), 35, 't5')
+            t5.delete()
+            self.t3.description = 'not counted'
+            self.t3.save()
+            refresh_buckets.assert_not_called()
+            # The maximum of its bucket, which can't be taken out by a delta
+            self.t3.delete()
+            refresh_buckets.assert_called_once()
+        self.assertIn((datetime.date(2021, 2, 1), None, 30, 1), self.rollup_rows())
+        self.assertEqual(rollup.verify(), [])
+
+    def test_bulk_paths(self):
+        data = [ dict(transaction_date='2021-03-01', bill_date='2021-03-01', from_account='acc1', to_account=None, transaction_amount=5,
+                      billed_amount=5, description=f'b{i}', category=None, original_currency='ILS', confirmation=None, notes=None) for i in range(3) ]
+        self.client.post('/transactions/?bulk=true', data, format='json')
+        Pattern.objects.create(name='all', matcher=dict(field="billed_amount", ge=0), target_category=self.food, enabled=True)
+        self.client.post('/transactions/recategorize/', dict(only_uncategorized=True), format='json')
+        self.assertEqual(rollup.verify(), [])
+        self.assertIn((datetime.date(2021, 3, 1), self.food.pk, 15, 3), self.rollup_rows())
+
+    def test_summary_from_rollup(self):
+        # Make the rollup table stale, to see which table the summary reads
+        Transaction.objects.filter(pk=self.t3.pk).update(billed_amount=1000)
+        response = self.client.get('/transactions/summary/?group_by=month&from=2021-01-01')
+        self.assertEqual([ (r['month'], r['sum'], r['count']) for r in response.data ], [
+            (datetime.date(2021, 1, 1), 30, 2), (datetime.date(2021, 2, 1), 40, 1)])
+        response = self.client.get('/transactions/summary/?group_by=month&from=2021-01-02')
+        self.assertEqual([ (r['month'], r['sum']) for r in response.data ], [
+            (datetime.date(2021, 1, 1), 20), (datetime.date(2021, 2, 1), 1000)])
+
+    def test_not_built(self):
+        RollupState.objects.all().delete()
+        # Changes aren't counted in a table that isn't built, and summaries aggregate the transactions
+        self.make(datetime.date(2021, 3, 1), 5, 't4')
+        self.assertNotIn(datetime.date(2021, 3, 1), [ r[0] for r in self.rollup_rows() ])
+        response = self.client.get('/transactions/summary/?group_by=month&from=2021-01-01')
+        self.assertEqual([ (r['month'], r['sum']) for r in response.data ], [
+            (datetime.date(2021, 1, 1), 30), (datetime.date(2021, 2, 1), 40), (datetime.date(2021, 3, 1), 5)])
+        call_command('rebuild_rollup', stdout=StringIO())
+        self.assertTrue(rollup.is_built())
+        self.assertIn((datetime.date(2021, 3, 1), None, 5, 1), self.rollup_rows())
+
+    def test_command(self):
+        Transaction.objects.filter(pk=self.t3.pk).update(billed_amount=1000)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollup', '--verify', stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_rollup', stdout=out)
+        self.assertIn('matches', out.getvalue())
+        self.assertIn((datetime.date(2021, 2, 1), None, 1000, 1), self.rollup_rows())
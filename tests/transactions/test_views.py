@@ -0,0 +1,100 @@
+import datetime
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from transactions.models import Transaction, Account, Category
+
+
+class ListTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.account1 = Account.objects.create(name='acc1', backend_id='1', backend_type='cal')
+        self.account2 = Account.objects.create(name='acc2', backend_id='2', backend_type='leumi')
+        self.food = Category.objects.create(title='food')
+        self.transactions = []
+        for i, date in enumerate([ datetime.date(2020, 12, 31), datetime.date(2021, 1, 1), datetime.date(2021, 1, 15), datetime.date(2021, 1, 15), datetime.date(2021, 2, 1) ]):
+            self.transactions.append(Transaction.objects.create(from_account=self.account1, to_account=self.account2 if i % 2 else None, category=self.food,
+                transaction_date=date, bill_date=date + datetime.timedelta(days=10), billed_amount=10 * (i + 1), transaction_amount=10 * (i + 1), original_currency='ILS', description=f't{i}'))
+
+    def list_all(self, url):
+        results = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            results += response.data['results']
+            url = response.data['next']
+        return [ r['description'] for r in results ]
+
+    def test_paginated(self):
+        self.assertEqual(self.list_all('/transactions/?page_size=2'), ['t0', 't1', 't2', 't3', 't4'])
+
+    def test_related_fields(self):
+        response = self.client.get('/transactions/')
+        self.assertEqual(response.data['results'][1]['from_account'], 'acc1')
+        self.assertEqual(response.data['results'][1]['to_account'], 'acc2')
+        self.assertEqual(response.data['results'][1]['category'], 'food')
+
+    def test_queries_dont_grow(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/transactions/')
+        self.assertEqual(len(queries), 1)
+
+    def test_by_date(self):
+        self.assertEqual(self.list_all('/transactions/by_date/2021/'), ['t1', 't2', 't3', 't4'])
+        self.assertEqual(self.list_all('/transactions/by_date/2021/1/?page_size=1'), ['t1', 't2', 't3'])
+
+    def test_by_date_day(self):
+        self.assertEqual(self.list_all('/transactions/by_date/2021/1/15/'), ['t2', 't3'])
+        self.assertEqual(self.list_all('/transactions/by_date/2020/12/31/'), ['t0'])
+
+    def test_by_date_bad_date(self):
+        self.assertEqual(self.client.get('/transactions/by_date/2021/13/').status_code, 400)
+        self.assertEqual(self.client.get('/transactions/by_date/99999999999/').status_code, 400)
+        self.assertEqual(self.client.get('/transactions/by_date/9999/12/').status_code, 400)
+        self.assertEqual(self.client.get('/transactions/by_date/2021/1/99999999999/').status_code, 400)
+
+    def test_date_params(self):
+        self.assertEqual(self.list_all('/transactions/?from=2021-01-01&to=2021-02-01'), ['t1', 't2', 't3'])
+        self.assertEqual(self.list_all('/transactions/?bill_from=2021-01-11&bill_to=2021-01-26'), ['t1', 't2', 't3'])
+        self.assertEqual(self.list_all('/transactions/by_date/2021/?to=2021-01-15'), ['t1'])
+        self.assertEqual(self.client.get('/transactions/?from=soon').status_code, 400)
+
+
+class SummaryTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.account1 = Account.objects.create(name='acc1', backend_id='1', backend_type='cal')
+        self.account2 = Account.objects.create(name='acc2', backend_id='2', backend_type='leumi')
+        self.food = Category.objects.create(title='food')
+        make = lambda date, amount, category, account, description: Transaction.objects.create(from_account=account, category=category,
+            transaction_date=date, bill_date=date + datetime.timedelta(days=10), billed_amount=amount, transaction_amount=amount, original_currency='ILS', description=description)
+        make(datetime.date(2021, 1, 1), 10, self.food, self.account1, 't0')
+        make(datetime.date(2021, 1, 25), 20, self.food, self.account1, 't1')
+        make(datetime.date(2021, 1, 30), 5, None, self.account2, 't2')
+        make(datetime.date(2021, 2, 3), 40, self.food, self.account2, 't3')
+
+    def test_totals(self):
+        response = self.client.get('/transactions/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [dict(sum=75, count=4, min=5, max=40)])
+
+    def test_group_by(self):
+        response = self.client.get('/transactions/summary/?group_by=category,month')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([ dict(r) for r in response.data ], [
+            dict(category=None, month=datetime.date(2021, 1, 1), sum=5, count=1, min=5, max=5),
+            dict(category='food', month=datetime.date(2021, 1, 1), sum=30, count=2, min=10, max=20),
+            dict(category='food', month=datetime.date(2021, 2, 1), sum=40, count=1, min=40, max=40),
+        ])
+
+    def test_group_by_with_dates(self):
+        response = self.client.get('/transactions/summary/?group_by=from_account,bill_month&from=2021-01-02')
+        self.assertEqual([ (r['from_account'], r['bill_month'], r['sum']) for r in response.data ], [
+            ('acc1', datetime.date(2021, 2, 1), 20),
+            ('acc2', datetime.date(2021, 2, 1), 45),
+        ])
+
+    def test_bad_group(self):
+        self.assertEqual(self.client.get('/transactions/summary/?group_by=month,weather').status_code, 400)
@@ -1,7 +1,12 @@
 import warnings
+import collections
+import functools
+import json
+import operator
 
 import jsonschema
 import re
+from django.db.models import Q
 
 _PATTERN_SCHEMA = {
   "$id": "https://localhost:8000/category_pattern.schema.json",
@@ -81,60 +86,490 @@ _VALIDATOR = jsonschema.Draft7Validator(_PATTERN_SCHEMA)
 def verify_rule(rule):
     return _VALIDATOR.validate(rule)
 
-def _transform(field_name, field_attr, field_value):
+def _field_getter(field):
     """
-    Transform complex field values into simple values that we can compare against
+    Return a function that extracts a simple value, that we can compare against, of field out of a transaction
     """
-    if field_name in ['transaction_date', 'bill_date']:
-        if field_attr == 'day':
-            return field_value.day
+    field_name, _, field_attr = field.partition('$')
+    if field_name in ['transaction_date', 'bill_date'] and field_attr == 'day':
+        return lambda transaction: getattr(transaction, field_name).day
     if field_name in ['from_account', 'to_account']:
-        if field_value is None:
-            return field_value
-        return field_value.name
-    return field_value
+        def get_account_name(transaction):
+            account = getattr(transaction, field_name)
+            if account is None:
+                return None
+            return account.name
+        return get_account_name
+    return operator.attrgetter(field_name)
+
+def _compile_conditions(rule):
+    """
+    Compile the operators of a single pattern into a function that tests a field value.
+    Only the operators present in the pattern are checked.
+    """
+    conditions = []
+    if 'eq' in rule:
+        eq = rule['eq']
+        conditions.append(lambda value: str(value) == eq)
+    if 'lt' in rule:
+        lt = rule['lt']
+        conditions.append(lambda value: value < lt)
+    if 'le' in rule:
+        le = rule['le']
+        conditions.append(lambda value: value <= le)
+    if 'gt' in rule:
+        gt = rule['gt']
+        conditions.append(lambda value: value > gt)
+    if 'ge' in rule:
+        ge = rule['ge']
+        conditions.append(lambda value: value >= ge)
+    if 'regex' in rule:
+        search = re.compile(rule['regex']).search
+        conditions.append(lambda value: search(str(value)) is not None)
+    if 'isnull' in rule:
+        isnull = rule['isnull']
+        conditions.append(lambda value: (value is None) == isnull)
+
+    if len(conditions) == 1:
+        return conditions[0]
+    return lambda value: all([ c(value) for c in conditions ])
+
+def compile_rule(rule):
+    """
+    Compile a rule into a function that takes a transaction and returns whether the rule matches it.
+    """
+    if 'and' in rule:
+        predicates = [ compile_rule(r) for r in rule['and'] ]
+        return lambda transaction: all(p(transaction) for p in predicates)
+    if 'or' in rule:
+        predicates = [ compile_rule(r) for r in rule['or'] ]
+        return lambda transaction: any(p(transaction) for p in predicates)
+    if 'not' in rule:
+        predicate = compile_rule(rule['not'])
+        return lambda transaction: not predicate(transaction)
+
+    get_value = _field_getter(rule['field'])
+    test = _compile_conditions(rule)
+    return lambda transaction: test(get_value(transaction))
 
 def run_rule(transaction, rule):
+    return compile_rule(rule)(transaction)
+
+# How pattern fields are looked up by the ORM
+_LOOKUP_FIELDS = {
+    'transaction_date$day': 'transaction_date__day',
+    'bill_date$day': 'bill_date__day',
+    'from_account': 'from_account__name',
+    'to_account': 'to_account__name',
+}
+_DAY_FIELDS = ['transaction_date$day', 'bill_date$day']
+_NUMERIC_FIELDS = _DAY_FIELDS + ['transaction_amount', 'billed_amount']
+_NULLABLE_FIELDS = ['from_account', 'to_account', 'billed_amount', 'original_currency', 'notes']
+_COMPARISON_LOOKUPS = { 'lt': 'lt', 'le': 'lte', 'gt': 'gt', 'ge': 'gte' }
+
+def _pattern_to_q(rule):
+    """
+    Translate a single pattern into a Q object that matches the same transactions, or return None if it can't be.
+    """
+    field = rule['field']
+    lookup = _LOOKUP_FIELDS.get(field, field)
+    nullable = field in _NULLABLE_FIELDS
+    q = Q()
+    if 'eq' in rule:
+        eq = rule['eq']
+        if field in _DAY_FIELDS and eq.isdigit() and str(int(eq)) == eq:
+            q &= Q(**{lookup: int(eq)})
+        elif field not in _NUMERIC_FIELDS:
+            # Values are compared as strings, so None equals 'None'
+            matches = Q(**{lookup: eq})
+            if nullable and eq == 'None':
+                matches |= Q(**{f'{field}__isnull': True})
+            q &= matches
+        else:
+            return None
+    for op, orm_op in _COMPARISON_LOOKUPS.items():
+        if op in rule:
+            if field not in _NUMERIC_FIELDS:
+                return None
+            q &= Q(**{f'{lookup}__{orm_op}': rule[op]})
+    if 'regex' in rule:
+        if field in _NUMERIC_FIELDS:
+            return None
+        matches = Q(**{f'{lookup}__regex': rule['regex']})
+        if nullable and re.search(rule['regex'], 'None'):
+            matches |= Q(**{f'{field}__isnull': True})
+        q &= matches
+    if 'isnull' in rule:
+        if field in _DAY_FIELDS:
+            return None
+        q &= Q(**{f'{field}__isnull': rule['isnull']})
+    return q
+
+def split_rule(rule):
+    """
+    Split a rule into a Q object, for the part of it the database can check, and a rule for the rest, or None if
+    there's no rest. A transaction matches rule if it matches both.
+    """
     if 'and' in rule:
-        return all([ run_rule(transaction, r) for r in rule['and']])
+        q = Q()
+        residuals = []
+        for r in rule['and']:
+            sub_q, residual = split_rule(r)
+            q &= sub_q
+            if residual is not None:
+                residuals.append(residual)
+        if not residuals:
+            return q, None
+        return q, residuals[0] if len(residuals) == 1 else {'and': residuals}
     if 'or' in rule:
-        return any([ run_rule(transaction, r) for r in rule['or']])
+        parts = [ split_rule(r) for r in rule['or'] ]
+        if any(residual is not None for _, residual in parts):
+            return Q(), rule
+        return functools.reduce(operator.or_, (q for q, _ in parts)), None
     if 'not' in rule:
-        return not run_rule(transaction, rule['not'])
+        q, residual = split_rule(rule['not'])
+        if residual is not None:
+            return Q(), rule
+        return ~q, None
 
-    field_name, _, field_attr = rule['field'].partition('$')
-    field_value = _transform(field_name, field_attr, getattr(transaction, field_name))
-    conditions = []
-    try:
-        conditions.append(str(field_value) == rule['eq'])
-    except KeyError:
-        pass
-    try:
-        conditions.append(field_value < rule['lt'])
-    except KeyError:
-        pass
-    try:
-        conditions.append(field_value <= rule['le'])
-    except KeyError:
-        pass
-    try:
-        conditions.append(field_value > rule['gt'])
-    except KeyError:
-        pass
-    try:
-        conditions.append(field_value >= rule['ge'])
-    except KeyError:
-        pass
-    try:
-        conditions.append(re.search(rule['regex'], str(field_value)))
-    except KeyError:
-        pass
+    q = _pattern_to_q(rule)
+    if q is None:
+        return Q(), rule
+    return q, None
+
+# Compiled Pattern matchers, keyed by pattern id. Each entry holds the matcher it was compiled from as a stamp,
+# so changing a Pattern's matcher invalidates its entry.
+_compiled_patterns = {}
+
+def _stamp(matcher):
+    return json.dumps(matcher, sort_keys=True)
+
+def _pattern_stamp(pattern):
+    """
+    Return the stamp of a Pattern's matcher. It's memoized on the object until its matcher is replaced.
+    """
+    memo = getattr(pattern, '_matcher_stamp', None)
+    if memo is None or memo[0] is not pattern.matcher:
+        memo = (pattern.matcher, _stamp(pattern.matcher))
+        pattern._matcher_stamp = memo
+    return memo[1]
+
+def get_predicate(pattern):
+    """
+    Return the compiled matcher of a Pattern object. Compilation is cached as long as the matcher doesn't change.
+
+    The predicate is memoized on the object too, so looking it up again doesn't serialize the matcher.
+    """
+    memo = getattr(pattern, '_predicate', None)
+    if memo is not None and memo[0] is pattern.matcher:
+        return memo[1]
+    stamp = _pattern_stamp(pattern)
+    cached = _compiled_patterns.get(pattern.pk)
+    if cached is not None and cached[0] == stamp:
+        predicate = cached[1]
+    else:
+        predicate = compile_rule(pattern.matcher)
+        if pattern.pk is not None:
+            _compiled_patterns[pattern.pk] = (stamp, predicate)
+    pattern._predicate = (pattern.matcher, predicate)
+    return predicate
+
+def _to_mask(size, indices):
+    """
+    Build a bitmask with the bits of indices set, bit i standing for the i-th transaction of a batch
+    """
+    bits = bytearray(b'0' * size)
+    for i in indices:
+        bits[size - 1 - i] = ord('1')
+    return int(bits, 2) if size else 0
+
+def _mask_indices(mask):
+    return [ i for i, b in enumerate(bin(mask)[:1:-1]) if b == '1' ]
+
+class _Batch:
+    """
+    Transactions packed into columns of simple values, on which rules are evaluated as bitmasks.
+
+    Columns are extracted lazily, once per field. Masks of single patterns are memoized so patterns
+    shared between rules are only tested once per transaction.
+    """
+    def __init__(self, transactions):
+        self.transactions = transactions
+        self.size = len(transactions)
+        self._columns = {}
+        self._masks = {}
+
+    def column(self, field):
+        if field not in self._columns:
+            get_value = _field_getter(field)
+            self._columns[field] = [ get_value(t) for t in self.transactions ]
+        return self._columns[field]
+
+    def evaluate(self, rule, scope):
+        """
+        Return the mask of transactions in scope that match rule
+        """
+        if not scope:
+            return 0
+        if 'and' in rule:
+            for r in rule['and']:
+                scope = self.evaluate(r, scope)
+            return scope
+        if 'or' in rule:
+            mask = 0
+            for r in rule['or']:
+                mask |= self.evaluate(r, scope & ~mask)
+            return mask
+        if 'not' in rule:
+            return scope & ~self.evaluate(rule['not'], scope)
+
+        key = _stamp(rule)
+        cached = self._masks.get(key)
+        if cached is not None and not scope & ~cached[0]:
+            return scope & cached[1]
+        test = _compile_conditions(rule)
+        column = self.column(rule['field'])
+        mask = _to_mask(self.size, (i for i in _mask_indices(scope) if test(column[i])))
+        self._masks[key] = (scope, mask)
+        return mask
+
+def _skip_group(pattern, i):
+    """
+    Return the index right after the group or character class that starts at index i of a regular expression
+    """
+    depth = 0
+    in_class = False
+    class_start = None
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if in_class:
+            if c == ']' and i != class_start:
+                in_class = False
+                if depth == 0:
+                    return i + 1
+        elif c == '[':
+            in_class = True
+            class_start = i + 1 + (pattern[i + 1:i + 2] == '^')
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+def _escape_length(pattern, i):
+    """
+    Return the length of the escape sequence that starts with the backslash at index i of a regular expression
+    """
+    escaped = pattern[i + 1:i + 2]
+    if escaped in ('x', 'u', 'U'):
+        return 2 + dict(x=2, u=4, U=8)[escaped]
+    if escaped == 'N' and pattern[i + 2:i + 3] == '{':
+        end = pattern.find('}', i)
+        return len(pattern) - i if end == -1 else end + 1 - i
+    if escaped.isdigit():
+        # Octal escapes and group references have up to 3 digits
+        length = 2
+        while length < 4 and pattern[i + length:i + length + 1].isdigit():
+            length += 1
+        return length
+    return 2
+
+def _required_literal(pattern):
+    """
+    Return the longest literal string that every match of the regular expression contains, or None.
+
+    This is conservative: groups, character classes and anything optional just end the current literal.
+    """
     try:
-        conditions.append((field_value is None) == rule['isnull'])
-    except KeyError:
-        pass
+        if re.compile(pattern).flags & (re.IGNORECASE | re.VERBOSE):
+            return None
+    except re.error:
+        return None
+
+    literals = ['']
+    last_is_literal = False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '|':
+            return None
+        if c in '?*+{':
+            # The character before ?, * and {m,n} may not appear at all
+            if last_is_literal and c != '+':
+                literals[-1] = literals[-1][:-1]
+            if c == '{':
+                end = pattern.find('}', i)
+                i = len(pattern) if end == -1 else end
+            literals.append('')
+            last_is_literal = False
+        elif c == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if escaped and not escaped.isalnum():
+                literals[-1] += escaped
+                last_is_literal = True
+                i += 1
+            else:
+                # Class escapes and escapes of characters by code aren't literal text, skip all of them
+                literals.append('')
+                last_is_literal = False
+                i += _escape_length(pattern, i) - 1
+        elif c in '([':
+            i = _skip_group(pattern, i) - 1
+            literals.append('')
+            last_is_literal = False
+        elif c in '.^$':
+            literals.append('')
+            last_is_literal = False
+        else:
+            literals[-1] += c
+            last_is_literal = True
+        i += 1
+
+    return max(literals, key=len) or None
+
+# Fields whose values are scanned by RuleIndex
+_INDEXED_FIELDS = ['description', 'notes']
+
+def _guard(rule):
+    """
+    Return a list of (field, literal) pairs, at least one of which must be found in the field's value for rule
+    to match. Return None if there's no such list.
+    """
+    if 'and' in rule:
+        guards = [ g for g in map(_guard, rule['and']) if g ]
+        if not guards:
+            return None
+        # Prefer fewer alternatives, then longer literals
+        return min(guards, key=lambda g: (len(g), -min(len(l) for _, l in g)))
+    if 'or' in rule:
+        guards = [ _guard(r) for r in rule['or'] ]
+        if not all(guards):
+            return None
+        return [ pair for g in guards for pair in g ]
+    if 'not' in rule:
+        return None
+
+    if rule['field'] not in _INDEXED_FIELDS:
+        return None
+    literal = None
+    if 'regex' in rule:
+        literal = _required_literal(rule['regex'])
+    if not literal and rule.get('eq'):
+        literal = rule['eq']
+    if not literal:
+        return None
+    return [(rule['field'], literal)]
+
+class _Automaton:
+    """
+    Aho-Corasick automaton, finding which of a set of literals appear in a text with a single scan of it
+    """
+    def __init__(self, literals):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        for literal in literals:
+            state = 0
+            for c in literal:
+                if c not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                    self._goto[state][c] = len(self._goto) - 1
+                state = self._goto[state][c]
+            self._output[state].add(literal)
 
-    return all(conditions)
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(c, 0)
+                self._output[child] |= self._output[self._fail[child]]
+
+    def find(self, text):
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        state = 0
+        for c in text:
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+class RuleIndex:
+    """
+    Prefilter for a list of rules.
+
+    Rules that can only match when a literal is found in description or notes (taken from regex or eq patterns)
+    are indexed by that literal. Each field of a transaction is scanned once to find all indexed literals in it,
+    and only the rules of the found literals, plus rules that couldn't be indexed, are candidates for matching.
+    """
+    def __init__(self, matchers):
+        matchers = list(matchers)
+        self._size = len(matchers)
+        self._unindexed = []
+        self._rules_by_literal = {}
+        for i, matcher in enumerate(matchers):
+            guard = _guard(matcher)
+            if guard is None:
+                self._unindexed.append(i)
+                continue
+            for field, literal in guard:
+                self._rules_by_literal.setdefault(field, {}).setdefault(literal, []).append(i)
+        self._automata = { field: _Automaton(literals) for field, literals in self._rules_by_literal.items() }
+
+    def candidates(self, transaction):
+        """
+        Return the positions of rules that may match transaction, in order
+        """
+        positions = set(self._unindexed)
+        for field, automaton in self._automata.items():
+            rules_by_literal = self._rules_by_literal[field]
+            for literal in automaton.find(str(getattr(transaction, field))):
+                positions.update(rules_by_literal[literal])
+        return sorted(positions)
+
+    def candidate_masks(self, batch):
+        """
+        Return a mask for every rule, of the transactions in batch that it may match.
+        Rules that weren't indexed get None, as they may match any transaction.
+        """
+        indices = {}
+        for field, automaton in self._automata.items():
+            rules_by_literal = self._rules_by_literal[field]
+            for row, value in enumerate(batch.column(field)):
+                for literal in automaton.find(str(value)):
+                    for position in rules_by_literal[literal]:
+                        indices.setdefault(position, []).append(row)
+        masks = [ _to_mask(batch.size, indices.get(i, [])) for i in range(self._size) ]
+        for i in self._unindexed:
+            masks[i] = None
+        return masks
+
+# The RuleIndex of the last list of rules that was used, with the stamps of the list's patterns
+_index_cache = (None, None)
+
+def get_index(rules):
+    """
+    Return a RuleIndex of a list of Pattern objects. It's rebuilt only if the list's patterns change.
+    """
+    global _index_cache
+    key = tuple((r.pk, _pattern_stamp(r)) for r in rules)
+    if _index_cache[0] != key:
+        _index_cache = (key, RuleIndex([ r.matcher for r in rules ]))
+    return _index_cache[1]
 
 def categorize(rules, transaction):
     """
@@ -143,6 +578,28 @@ def categorize(rules, transaction):
     rules are a list of Pattern objects. transaction is Transaction object.
     return value is a Category object or None
     """
-    for r in rules:
-        if run_rule(transaction, r.matcher):
-            return r.target_category
+    for i in get_index(rules).candidates(transaction):
+        if get_predicate(rules[i])(transaction):
+            return rules[i].target_category
+
+def categorize_many(rules, transactions):
+    """
+    Categorize a batch of transactions at once. The first matching rule wins, like in categorize.
+
+    rules are a list of Pattern objects. transactions is a list of Transaction objects.
+    return value is a list of Category objects or None, one for each transaction
+    """
+    rules = list(rules)
+    batch = _Batch(transactions)
+    candidates = get_index(rules).candidate_masks(batch)
+    categories = [None] * batch.size
+    remaining = (1 << batch.size) - 1
+    for r, candidate_mask in zip(rules, candidates):
+        if not remaining:
+            break
+        scope = remaining if candidate_mask is None else remaining & candidate_mask
+        matched = batch.evaluate(r.matcher, scope)
+        for i in _mask_indices(matched):
+            categories[i] = r.target_category
+        remaining &= ~matched
+    return categories
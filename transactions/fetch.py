@@ -0,0 +1,149 @@
+import datetime
+import itertools
+
+from django.db import transaction
+
+import fetchers
+import auth_sources
+from .models import AuthSource, Account
+from .auto_category import categorize_many
+from .recategorize import enabled_rules
+from . import ingest
+from . import sync
+
+
+def parse_bool(value):
+    return value in (True, 1, 'true', 'True', '1')
+
+
+class FetchError(Exception):
+    def __init__(self, message, status=400):
+        self.message = message
+        self.status = status
+
+
+def loop_months(month, year, end_month, end_year):
+    if (not 1 <= month <= 12) or (not 1 <= end_month <= 12) or year <= 0 or end_year <= 0:
+        raise ValueError("months must be between 1 and 12, years must be positive")
+    while year < end_year or (year == end_year and month <= end_month):
+        yield month, year
+        month += 1
+        if month == 13:
+            month = 1
+            year += 1
+
+
+class FetchRequest:
+    """
+    A fetch of a backend's transactions, as requested by the parameters of the fetch endpoints.
+    Bad parameters raise FetchError with the HTTP status to respond with.
+    """
+    def __init__(self, backend, data):
+        self.backend_name = backend
+        try:
+            self.backend = fetchers.get_backend(backend)
+        except KeyError:
+            raise FetchError(f'Unknown backend: {backend}', status=404)
+        try:
+            auth_source_obj = AuthSource.objects.all()[0]
+            self.auth_source = auth_sources.get_backend(auth_source_obj.auth_type)(**auth_source_obj.settings)
+        except KeyError:
+            raise FetchError(f'Unknown auth source: {auth_source_obj.auth_type}', status=404)
+        try:
+            self.passwd = data["pass"]
+            month = int(data.get("month", datetime.date.today().month))
+            year = int(data.get("year", datetime.date.today().year))
+            end_month = int(data.get('end_month', month))
+            end_year = int(data.get("end_year", year))
+            get_item_id = lambda a: a.auth_source_item_id
+            self.accounts_by_auth_source = [ (item_id, list(accounts)) for item_id, accounts in
+                itertools.groupby(sorted(Account.objects.filter(backend_type=backend), key=get_item_id), key=get_item_id) ]
+            self.auto_category_rules = enabled_rules()
+        except KeyError as e:
+            raise FetchError("'pass' param is required")
+        except ValueError:
+            raise FetchError("'month' and 'year' must be integers")
+        except Exception as e:
+            raise FetchError(f'Error: {e}', status=500)
+        try:
+            # Validate the requested range even if since_last_sync moves its start
+            self.months = list(loop_months(month, year, end_month, end_year))
+        except ValueError as e:
+            raise FetchError(str(e))
+        if parse_bool(data.get('since_last_sync', False)):
+            # Without a requested month, the fetch starts from the last sync and ends in the current month
+            accounts = [ a for _, group in self.accounts_by_auth_source for a in group ]
+            if 'month' in data or 'year' in data:
+                start_month, start_year = sync.start_month(accounts, month, year)
+            else:
+                start_month, start_year = sync.start_month(accounts)
+                if start_month is None:
+                    start_month, start_year = month, year
+            self.months = list(loop_months(start_month, start_year, end_month, end_year))
+
+    def get_groups(self):
+        """
+        Return (authinfo, accounts) pairs for every group of accounts that share credentials
+        """
+        try:
+            with self.auth_source.unlock(self.passwd):
+                auth_infos = self.auth_source.get_auth_infos([ item_id for item_id, _ in self.accounts_by_auth_source ])
+            return [ (auth_info, accounts) for auth_info, (_, accounts) in zip(auth_infos, self.accounts_by_auth_source) ]
+        except auth_sources.AuthError as e:
+            raise FetchError(str(e))
+
+    def iter_months(self, groups):
+        """
+        Yield (group index, month index, transactions) for each month of each group, categorized, in order and as
+        soon as they're fetched
+        """
+        try:
+            for group_idx, month_idx, transactions in fetchers.iter_fetch(self.backend, groups, self.months):
+                for t, category in zip(transactions, categorize_many(self.auto_category_rules, transactions)):
+                    t.category = category
+                yield group_idx, month_idx, transactions
+        except fetchers.FetchException as e:
+            raise FetchError(str(e))
+
+    def run(self, progress=None):
+        """
+        Fetch and categorize the transactions. progress, if given, is called with the number of months done, the
+        number of months to do and the number of transactions found whenever a month is done.
+        """
+        groups = self.get_groups()
+        months_total = len(groups) * len(self.months)
+        transactions = []
+        for months_done, (_, _, month_transactions) in enumerate(self.iter_months(groups), 1):
+            transactions += month_transactions
+            if progress:
+                progress(months_done, months_total, len(transactions))
+        return transactions
+
+
+def store(fetch_request):
+    """
+    Fetch and write the transactions that aren't stored yet, in one database transaction, and update the sync
+    state of the accounts. Months that didn't change since they were last stored, and whose transactions are all
+    still stored, aren't written again. A month is recorded as synced only once all its transactions are stored.
+    Return the number of transactions fetched, inserted and skipped, and the ids of the inserted ones.
+    """
+    groups = fetch_request.get_groups()
+    tracker = sync.SyncTracker([ a for _, accounts in groups for a in accounts ])
+    fetched = []
+    for group_idx, month_idx, transactions in fetch_request.iter_months(groups):
+        month, year = fetch_request.months[month_idx]
+        accounts = groups[group_idx][1]
+        fetched.append((accounts, month, year, transactions, tracker.changed(accounts, month, year, transactions)))
+    with transaction.atomic():
+        # Unchanged months are written again if some of their transactions were deleted or never stored
+        missing = { id(t) for t in ingest.unstored([ t for *_, transactions, changed in fetched if not changed for t in transactions ]) }
+        to_write = [ (i, t) for i, (*_, transactions, changed) in enumerate(fetched)
+                     if changed or any(id(t) in missing for t in transactions) for t in transactions ]
+        written, errors = ingest.bulk_insert([ t.to_model() for _, t in to_write ])
+        failed_months = { to_write[i][0] for i, error in errors.items() if error != ingest.DUPLICATE_MESSAGE }
+        for i, (accounts, month, year, transactions, _) in enumerate(fetched):
+            if i not in failed_months:
+                tracker.record(accounts, month, year, transactions)
+        tracker.save()
+    total = sum(len(transactions) for *_, transactions, _ in fetched)
+    return dict(fetched=total, inserted=len(written), skipped=total - len(written), ids=[ t.pk for _, t in written ])
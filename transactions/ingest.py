@@ -0,0 +1,100 @@
+import datetime
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Transaction
+from . import rollup
+
+CHUNK_SIZE = 500
+
+DUPLICATE_MESSAGE = 'Transaction already exists'
+NOT_WRITTEN_MESSAGE = 'Transaction was not written'
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+def transaction_key(t):
+    """
+    Return the values the unique constraints of Transaction check, or None if t can't conflict with anything.
+
+    The constraints are on (transaction_date, from_account, to_account, billed_amount, description), split into
+    three because SQL never considers NULLs equal. Here None equals None, so one key covers all of them.
+    """
+    if t.billed_amount is None:
+        return None
+    amount = Decimal(str(t.billed_amount)).quantize(Decimal('0.001'))
+    return (_as_date(t.transaction_date), t.from_account_id, t.to_account_id, amount, t.description)
+
+def _stored_keys(transactions):
+    """
+    Return a dict of key to id of the stored transactions that may conflict with transactions, in one query
+    """
+    dates = [ _as_date(t.transaction_date) for t in transactions ]
+    account_ids = { t.from_account_id for t in transactions } | { t.to_account_id for t in transactions }
+    account_ids.discard(None)
+    stored = Transaction.objects.filter(
+        Q(from_account__in=account_ids) | Q(to_account__in=account_ids),
+        transaction_date__range=(min(dates), max(dates)),
+        billed_amount__isnull=False,
+    )
+    return { transaction_key(t): t.pk for t in stored.only('transaction_date', 'from_account', 'to_account', 'billed_amount', 'description') }
+
+def unstored(transactions):
+    """
+    Return the transactions that have a key and aren't stored. Transactions without a key can't be told apart from
+    the stored ones, so they're never returned.
+    """
+    keyed = [ t for t in transactions if transaction_key(t) is not None ]
+    if not keyed:
+        return []
+    stored = _stored_keys(keyed)
+    return [ t for t in keyed if transaction_key(t) not in stored ]
+
+def bulk_insert(transactions):
+    """
+    Insert the transactions that don't exist yet, in chunks and in a single database transaction.
+
+    Duplicates are found up front in one query, instead of relying on the unique constraints failing row by row.
+    Return a list of (index, Transaction) of the written transactions, and a dict of index to error message of
+    the rest.
+    """
+    transactions = list(transactions)
+    if not transactions:
+        return [], {}
+
+    errors = {}
+    keyed = []
+    unkeyed = []
+    with transaction.atomic():
+        stored = _stored_keys(transactions)
+        seen = set()
+        for i, t in enumerate(transactions):
+            key = transaction_key(t)
+            if key is None:
+                unkeyed.append((i, t))
+            elif key in stored or key in seen:
+                errors[i] = DUPLICATE_MESSAGE
+            else:
+                seen.add(key)
+                keyed.append((i, t))
+
+        Transaction.objects.bulk_create([ t for _, t in keyed ], batch_size=CHUNK_SIZE, ignore_conflicts=True)
+        # Transactions without a key can't conflict, and inserting them without ignore_conflicts gets their ids
+        Transaction.objects.bulk_create([ t for _, t in unkeyed ], batch_size=CHUNK_SIZE)
+
+        # Ignoring conflicts doesn't return ids, so get them, along with which rows were really written
+        if keyed:
+            stored = _stored_keys([ t for _, t in keyed ])
+        for i, t in keyed:
+            t.pk = stored.get(transaction_key(t))
+            if t.pk is None:
+                errors[i] = NOT_WRITTEN_MESSAGE
+
+        # bulk_create doesn't send signals, so the rollup table is refreshed here
+        rollup.refresh_months([ t.transaction_date for _, t in keyed + unkeyed if t.pk is not None ])
+
+    written = sorted([ (i, t) for i, t in keyed + unkeyed if t.pk is not None ], key=lambda x: x[0])
+    return written, errors
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import socket
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .models import FetchJob
+from .fetch import FetchRequest, FetchError
+
+_executor = None
+_executor_lock = threading.Lock()
+# Futures of the jobs queued by this process, by job id
+_futures = {}
+_futures_lock = threading.Lock()
+# Jobs record the process that runs them, which keeps their heartbeat up to date while they're queued or running
+OWNER = f'{socket.gethostname()}:{os.getpid()}'
+
+def _heartbeat_interval():
+    return getattr(settings, 'FETCH_JOB_HEARTBEAT_INTERVAL', 30)
+
+def _beat():
+    while True:
+        time.sleep(_heartbeat_interval())
+        with _futures_lock:
+            job_ids = list(_futures)
+        try:
+            if job_ids:
+                FetchJob.objects.filter(pk__in=job_ids).update(heartbeat=timezone.now())
+            fail_stale()
+        except Exception:
+            pass
+        finally:
+            connection.close()
+
+def _get_executor():
+    """
+    Return the pool of worker threads that run fetch jobs, starting it on first use
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'FETCH_JOB_WORKERS', 2), thread_name_prefix='fetch-job')
+            threading.Thread(target=_beat, name='fetch-job-heartbeat', daemon=True).start()
+        return _executor
+
+def run(job_id, fetch_request):
+    """
+    Run a fetch job, keeping its FetchJob row up to date with its progress and result
+    """
+    def progress(months_done, months_total, rows_found):
+        FetchJob.objects.filter(pk=job_id).update(months_done=months_done, months_total=months_total, rows_found=rows_found)
+
+    FetchJob.objects.filter(pk=job_id).update(status=FetchJob.RUNNING)
+    try:
+        transactions = fetch_request.run(progress=progress)
+        serialized_transactions = [ t.to_dict() for t in transactions ]
+        result = json.loads(JSONRenderer().render(serialized_transactions))
+        FetchJob.objects.filter(pk=job_id).update(status=FetchJob.DONE, result=result, rows_found=len(result))
+    except FetchError as e:
+        FetchJob.objects.filter(pk=job_id).update(status=FetchJob.FAILED, error=e.message)
+    except Exception as e:
+        FetchJob.objects.filter(pk=job_id).update(status=FetchJob.FAILED, error=f'Error: {e}')
+
+def _run_in_worker(job_id, fetch_request):
+    try:
+        run(job_id, fetch_request)
+    finally:
+        # Worker threads get their own database connections, which Django doesn't close for them
+        connection.close()
+        with _futures_lock:
+            _futures.pop(job_id, None)
+
+def submit(backend, data):
+    """
+    Create a FetchJob and queue it on the workers. The password in data is only kept in memory, by the queued job.
+    Bad parameters raise FetchError right away.
+    """
+    fetch_request = FetchRequest(backend, data)
+    params = { k: v for k, v in data.items() if k != 'pass' }
+    months_total = len(fetch_request.accounts_by_auth_source) * len(fetch_request.months)
+    with _futures_lock:
+        job = FetchJob.objects.create(backend=backend, params=params, months_total=months_total, owner=OWNER, heartbeat=timezone.now())
+        _futures[job.pk] = _get_executor().submit(_run_in_worker, job.pk, fetch_request)
+    return job
+
+def fail_stale():
+    """
+    Mark jobs that are pending or running but missed several heartbeats as failed, since the process that ran
+    them exited. Return the number of jobs marked.
+    """
+    deadline = timezone.now() - datetime.timedelta(seconds=3 * _heartbeat_interval())
+    stale = FetchJob.objects.filter(Q(heartbeat__lt=deadline) | Q(heartbeat__isnull=True), status__in=[FetchJob.PENDING, FetchJob.RUNNING])
+    return stale.update(status=FetchJob.FAILED, error='The fetch was interrupted')
+
+def wait(job_id, timeout=None):
+    """
+    Wait for a queued job to finish, if it's still running in this process
+    """
+    future = _futures.get(job_id)
+    if future is not None:
+        future.result(timeout=timeout)
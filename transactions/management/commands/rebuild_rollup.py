@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions import rollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly rollup table from the transactions table, or verify it against it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help="Only compare the rollup table with the transactions table")
+
+    def handle(self, *args, verify=False, **options):
+        if not verify:
+            rollup.rebuild()
+        differences = rollup.verify()
+        for key, expected, stored in differences:
+            self.stdout.write(f'{key}: expected {expected}, stored {stored}')
+        if differences:
+            raise CommandError(f'{len(differences)} rollup rows differ from the transactions table')
+        self.stdout.write('Rollup table matches the transactions table')
@@ -81,3 +81,78 @@ class Transaction(models.Model):
                 name='some_account_not_null'
             )
         ]
+        # Date ranges by from_account are served by the index of unique_transfer, which starts with them
+        indexes = [
+            models.Index(fields=['transaction_date', 'to_account'], name='transaction_date_to_idx'),
+            models.Index(fields=['bill_date'], name='bill_date_idx'),
+        ]
+
+
+class MonthlyRollup(models.Model):
+    """
+    Totals of billed_amount per month of transaction_date, accounts, category and currency.
+    Kept up to date with the Transaction table by transactions.rollup.
+    """
+    month = models.DateField()
+    from_account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name="+", null=True, blank=True)
+    to_account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name="+", null=True, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+", null=True, blank=True)
+    original_currency = models.CharField(max_length=3, blank=True, null=True)
+    total = models.DecimalField(max_digits=15, decimal_places=3, blank=True, null=True)
+    count = models.IntegerField()
+    min_amount = models.DecimalField(max_digits=9, decimal_places=3, blank=True, null=True)
+    max_amount = models.DecimalField(max_digits=9, decimal_places=3, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['month'], name='rollup_month_idx'),
+        ]
+
+
+class RollupState(models.Model):
+    """
+    Marks the MonthlyRollup table as built. rebuild_rollup writes it, and until then the table is neither read nor
+    kept up to date.
+    """
+    built = models.DateTimeField(auto_now=True)
+
+
+class AccountSyncState(models.Model):
+    """
+    What was fetched and stored of an account so far, for incremental fetches
+    """
+    account = models.OneToOneField(Account, on_delete=models.CASCADE, related_name="sync_state")
+    last_transaction_date = models.DateField(null=True, blank=True)
+    last_bill_date = models.DateField(null=True, blank=True)
+    # Hash of the fetched transactions of every month, by 'YYYY-MM'
+    month_hashes = jsonfield.JSONField(default=dict)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.account} synced up to {self.last_transaction_date}"
+
+
+class FetchJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(s, s) for s in [PENDING, RUNNING, DONE, FAILED]]
+
+    backend = models.CharField(max_length=100)
+    # The fetch parameters, without the password, which is never stored
+    params = jsonfield.JSONField(null=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    months_total = models.IntegerField(default=0)
+    months_done = models.IntegerField(default=0)
+    rows_found = models.IntegerField(default=0)
+    result = jsonfield.JSONField(null=True)
+    error = models.TextField(blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    # The host and process that run the job, and when it last reported it's still queued or running there
+    owner = models.CharField(max_length=100, blank=True, default='')
+    heartbeat = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.backend} fetch {self.pk}: {self.status}"
@@ -0,0 +1,96 @@
+import functools
+import operator
+
+from django.db import transaction
+from django.db.models import Q, Case, When, Value, Count, BooleanField, IntegerField
+
+from .models import Transaction, Pattern
+from .auto_category import split_rule, compile_rule
+from . import rollup
+
+CHUNK_SIZE = 500
+
+def enabled_rules():
+    """
+    Return the list of enabled Pattern objects, in the order they're applied
+    """
+    return list(Pattern.objects.filter(enabled=True).select_related('target_category').order_by('id'))
+
+def _update_ids(ids, category):
+    for i in range(0, len(ids), CHUNK_SIZE):
+        Transaction.objects.filter(pk__in=ids[i:i + CHUNK_SIZE]).update(category=category)
+
+def _any(qs):
+    return functools.reduce(operator.or_, qs)
+
+def _claim_in_python(queryset, residual_rules, first_pushdown):
+    """
+    Return a dict of transaction id to the index of the rule that wins it, for the transactions that a rule with a
+    residual wins. residual_rules are (index, Q object, residual) tuples, first_pushdown is a Case giving the index
+    of the first rule without a residual that matches a transaction, if any.
+    """
+    predicates = { i: compile_rule(residual) for i, _, residual in residual_rules }
+    # Which rules' Q objects match is annotated, so the residuals are only evaluated where they're needed
+    matches = { f'_rule_{i}': Case(When(q, then=Value(True)), default=Value(False), output_field=BooleanField())
+                for i, q, _ in residual_rules }
+    rows = queryset.filter(_any([ q for _, q, _ in residual_rules ])).annotate(_first_pushdown=first_pushdown, **matches)
+    claimed = {}
+    for t in rows.select_related('from_account', 'to_account').iterator(chunk_size=CHUNK_SIZE):
+        for i, _, _ in residual_rules:
+            if t._first_pushdown is not None and t._first_pushdown < i:
+                break
+            if getattr(t, f'_rule_{i}') and predicates[i](t):
+                claimed[t.pk] = i
+                break
+    return claimed
+
+def recategorize(queryset, rules, only_uncategorized=False):
+    """
+    Apply a list of Pattern objects to the stored transactions of queryset. The first matching rule wins, and every
+    transaction is written and counted once.
+
+    Rules are split into the part that translates to a Q object and a residual the database can't check. Rules
+    without a residual are applied by a single UPDATE, setting the category with a CASE of their Q objects in order.
+    Residuals are evaluated in Python, only on the transactions their Q objects select, and the transactions they
+    win are excluded from the UPDATE and written by id.
+    Transactions that no rule matches keep their category.
+
+    Return a dict of pattern name to the number of transactions it updated.
+    """
+    months = list(queryset.dates('transaction_date', 'month'))
+    if only_uncategorized:
+        queryset = queryset.filter(category__isnull=True)
+
+    pushdown_rules = []
+    residual_rules = []
+    for i, r in enumerate(rules):
+        q, residual = split_rule(r.matcher)
+        # An empty Q object matches everything, but can't be a CASE condition
+        q = q if q else Q(pk__isnull=False)
+        if residual is None:
+            pushdown_rules.append((i, q))
+        else:
+            residual_rules.append((i, q, residual))
+    first_pushdown = Case(*[ When(q, then=Value(i)) for i, q in pushdown_rules ], default=Value(None), output_field=IntegerField())
+
+    updated = { r.name: 0 for r in rules }
+    with transaction.atomic():
+        claimed = _claim_in_python(queryset, residual_rules, first_pushdown) if residual_rules else {}
+        if pushdown_rules:
+            selected = queryset.filter(_any([ q for _, q in pushdown_rules ]))
+            if claimed:
+                selected = selected.exclude(pk__in=list(claimed))
+            counts = selected.annotate(_first_pushdown=first_pushdown).order_by().values('_first_pushdown').annotate(n=Count('pk'))
+            for c in counts:
+                updated[rules[c['_first_pushdown']].name] = c['n']
+            # UPDATE can't refer to joined fields, so conditions on them are turned into subqueries of ids
+            category = Case(*[ When(pk__in=Transaction.objects.filter(q).values('pk'), then=Value(rules[i].target_category_id))
+                               for i, q in pushdown_rules ], output_field=IntegerField())
+            selected.update(category=category)
+        for i, _, _ in residual_rules:
+            ids = [ pk for pk, rule_idx in claimed.items() if rule_idx == i ]
+            _update_ids(ids, rules[i].target_category)
+            updated[rules[i].name] = len(ids)
+        # UPDATE doesn't send signals, so the rollup table is refreshed here
+        rollup.refresh_months(months)
+    return updated
@@ -0,0 +1,150 @@
+import datetime
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Sum, Count, Min, Max
+from django.db.models.functions import TruncMonth
+
+from .models import Transaction, MonthlyRollup, RollupState
+
+# What rollup rows are keyed by, along with the month
+DIMENSIONS = ['from_account', 'to_account', 'category', 'original_currency']
+
+CHUNK_SIZE = 500
+
+def month_start(date):
+    return datetime.date(date.year, date.month, 1)
+
+def _next_month(month):
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def bucket(t):
+    """
+    Return the key of the rollup row a Transaction object is counted in
+    """
+    return (month_start(t.transaction_date), t.from_account_id, t.to_account_id, t.category_id, t.original_currency)
+
+def _aggregate(queryset):
+    """
+    Return unsaved MonthlyRollup objects with the totals of queryset's transactions
+    """
+    rows = queryset.order_by().values(*DIMENSIONS, month=TruncMonth('transaction_date')).annotate(
+        total=Sum('billed_amount'), count=Count('id'), min_amount=Min('billed_amount'), max_amount=Max('billed_amount'))
+    return [ MonthlyRollup(month=r['month'], from_account_id=r['from_account'], to_account_id=r['to_account'],
+                           category_id=r['category'], original_currency=r['original_currency'], total=r['total'],
+                           count=r['count'], min_amount=r['min_amount'], max_amount=r['max_amount']) for r in rows ]
+
+def _bucket_filter(key, month_field):
+    """
+    Return filter arguments for the rows of a bucket. month_field is the lookup of the month's first day.
+    """
+    month, *values = key
+    filters = { f'{month_field}__gte': month, f'{month_field}__lt': _next_month(month) }
+    for name, value in zip(DIMENSIONS, values):
+        if value is None:
+            filters[f'{name}__isnull'] = True
+        else:
+            filters[name] = value
+    return filters
+
+def refresh_buckets(keys):
+    """
+    Recompute the rollup rows of the given bucket keys. This is what single transaction changes use.
+    """
+    with transaction.atomic():
+        for key in set(keys):
+            MonthlyRollup.objects.filter(**_bucket_filter(key, 'month')).delete()
+            MonthlyRollup.objects.bulk_create(_aggregate(Transaction.objects.filter(**_bucket_filter(key, 'transaction_date'))))
+
+def _as_amount(value):
+    return None if value is None else Decimal(str(value))
+
+def add_to_bucket(key, amount):
+    """
+    Count a new transaction of billed_amount amount in the rollup row of a bucket key, without recomputing it
+    """
+    amount = _as_amount(amount)
+    month, from_account_id, to_account_id, category_id, original_currency = key
+    with transaction.atomic():
+        row = MonthlyRollup.objects.select_for_update().filter(**_bucket_filter(key, 'month')).first()
+        if row is None:
+            MonthlyRollup.objects.create(month=month, from_account_id=from_account_id, to_account_id=to_account_id,
+                                         category_id=category_id, original_currency=original_currency, total=amount,
+                                         count=1, min_amount=amount, max_amount=amount)
+            return
+        row.count += 1
+        if amount is not None:
+            row.total = amount if row.total is None else row.total + amount
+            row.min_amount = amount if row.min_amount is None else min(row.min_amount, amount)
+            row.max_amount = amount if row.max_amount is None else max(row.max_amount, amount)
+        row.save()
+
+def remove_from_bucket(key, amount):
+    """
+    Uncount a transaction of billed_amount amount from the rollup row of a bucket key. The row is only recomputed
+    if the transaction may have been its minimum or maximum.
+    """
+    amount = _as_amount(amount)
+    with transaction.atomic():
+        row = MonthlyRollup.objects.select_for_update().filter(**_bucket_filter(key, 'month')).first()
+        if row is None or (amount is not None and amount in (row.min_amount, row.max_amount)):
+            refresh_buckets([key])
+        elif row.count <= 1:
+            row.delete()
+        else:
+            row.count -= 1
+            if amount is not None:
+                row.total -= amount
+            row.save()
+
+def refresh_months(months):
+    """
+    Recompute the rollup rows of whole months, given by any of their dates. This is what bulk changes use.
+    Nothing is done until the table is built.
+    """
+    if not is_built():
+        return
+    months = sorted({ month_start(m) for m in months })
+    with transaction.atomic():
+        for i in range(0, len(months), CHUNK_SIZE):
+            MonthlyRollup.objects.filter(month__in=months[i:i + CHUNK_SIZE]).delete()
+        for month in months:
+            transactions = Transaction.objects.filter(transaction_date__gte=month, transaction_date__lt=_next_month(month))
+            MonthlyRollup.objects.bulk_create(_aggregate(transactions), batch_size=CHUNK_SIZE)
+
+def refresh_queryset(queryset):
+    """
+    Recompute the rollup rows of all months that queryset's transactions are in
+    """
+    refresh_months(queryset.dates('transaction_date', 'month'))
+
+def is_built():
+    """
+    Return whether the rollup table was built by rebuild. A database that had transactions before the table was
+    added has a partial one until then, and summaries can't be read from it.
+    """
+    return RollupState.objects.exists()
+
+def rebuild():
+    """
+    Recompute the whole rollup table
+    """
+    with transaction.atomic():
+        MonthlyRollup.objects.all().delete()
+        MonthlyRollup.objects.bulk_create(_aggregate(Transaction.objects.all()), batch_size=CHUNK_SIZE)
+        RollupState.objects.update_or_create(pk=1)
+
+def _rollup_key(r):
+    return (r.month, r.from_account_id, r.to_account_id, r.category_id, r.original_currency)
+
+def _rollup_values(r):
+    return (r.total, r.count, r.min_amount, r.max_amount)
+
+def verify():
+    """
+    Compare the rollup table with the transactions table.
+    Return a list of (key, expected values, stored values) of the rows that differ.
+    """
+    expected = { _rollup_key(r): _rollup_values(r) for r in _aggregate(Transaction.objects.all()) }
+    stored = { _rollup_key(r): _rollup_values(r) for r in MonthlyRollup.objects.all() }
+    return [ (key, expected.get(key), stored.get(key)) for key in sorted(expected.keys() | stored.keys(), key=str)
+             if expected.get(key) != stored.get(key) ]
@@ -1,9 +1,10 @@
-from .models import Account, AuthSource, Category, Transaction, Pattern
+from .models import Account, AuthSource, Category, Transaction, Pattern, FetchJob
 from rest_framework import serializers
 from django.db.models import Q, CheckConstraint
 from rest_framework.validators import UniqueTogetherValidator
 from .validators import validate_account_schema, validate_auth_source_schema, SchemaError
 from .auto_category import verify_rule
+from .ingest import bulk_insert
 
 
 class AuthSourceSerializer(serializers.ModelSerializer):
@@ -67,11 +68,58 @@ class PatternSerializer(serializers.ModelSerializer):
         return data
 
 
+class PrefetchedSlugRelatedField(serializers.SlugRelatedField):
+    """
+    A SlugRelatedField that resolves slugs from the lookup tables in the serializer context, if there's one for
+    its model. NonAtomicListSerializer fills them so bulk data doesn't cost a query per object.
+    """
+    @property
+    def lookup_key(self):
+        return (self.get_queryset().model._meta.label, self.slug_field)
+
+    def to_internal_value(self, data):
+        lookup = self.context.get('slug_lookups', {}).get(self.lookup_key)
+        if lookup is None or not isinstance(data, str):
+            return super().to_internal_value(data)
+        try:
+            return lookup[data]
+        except KeyError:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=data)
+
+
 class NonAtomicListSerializer(serializers.ListSerializer):
     """
     A serializer that writes bulk-data non atomically. This is to skip over objects that could not be written.
+
+    If the 'bulk' context flag is set, objects are written with bulk_insert instead of one by one.
     """
+    def to_internal_value(self, data):
+        self.prefetch_slugs(data)
+        return super().to_internal_value(data)
+
+    def prefetch_slugs(self, data):
+        """
+        Fetch all the objects the slug fields of data refer to, with one query per model, into the context
+        """
+        if not isinstance(data, list):
+            return
+        fields_by_key = {}
+        for field in self.child.fields.values():
+            if isinstance(field, PrefetchedSlugRelatedField) and not field.read_only:
+                fields_by_key.setdefault(field.lookup_key, []).append(field)
+
+        lookups = self.context.setdefault('slug_lookups', {})
+        for key, fields in fields_by_key.items():
+            slug_field = fields[0].slug_field
+            # Anything but a string is left for the field to reject, and may not even be hashable
+            slugs = { slug for item in data if isinstance(item, dict) for f in fields
+                      for slug in [item.get(f.field_name)] if isinstance(slug, str) }
+            queryset = fields[0].get_queryset().filter(**{f'{slug_field}__in': list(slugs)})
+            lookups[key] = { getattr(o, slug_field): o for o in queryset }
+
     def create(self, validated_data):
+        if self.context.get('bulk'):
+            return self.bulk_create(validated_data)
         written = []
         errors = []
         for t in validated_data:
@@ -83,11 +131,19 @@ class NonAtomicListSerializer(serializers.ListSerializer):
         self.create_errors = errors
         return written
 
+    def bulk_create(self, validated_data):
+        model = self.child.Meta.model
+        written, errors = bulk_insert([ model(**t) for t in validated_data ])
+        self.create_errors = [{}] * len(validated_data)
+        for i, message in errors.items():
+            self.create_errors[i] = serializers.ValidationError(dict(create=message)).detail
+        return [ t for _, t in written ]
+
 
 class TransactionSerializer(serializers.ModelSerializer):
-    category = serializers.SlugRelatedField(slug_field='title', queryset=Category.objects.all(), allow_null=True)
-    from_account = serializers.SlugRelatedField(slug_field='name', queryset=Account.objects.all(), allow_null=True)
-    to_account = serializers.SlugRelatedField(slug_field='name', queryset=Account.objects.all(), allow_null=True)
+    category = PrefetchedSlugRelatedField(slug_field='title', queryset=Category.objects.all(), allow_null=True)
+    from_account = PrefetchedSlugRelatedField(slug_field='name', queryset=Account.objects.all(), allow_null=True)
+    to_account = PrefetchedSlugRelatedField(slug_field='name', queryset=Account.objects.all(), allow_null=True)
 
     def create(self, validated_data):
        try:
@@ -105,3 +161,11 @@ class TransactionSerializer(serializers.ModelSerializer):
         fields = ['id', 'transaction_date', 'bill_date', 'from_account', 'to_account', 'transaction_amount', 'description', 'category', 'original_currency', 'billed_amount', 'confirmation', 'notes']
 
         list_serializer_class = NonAtomicListSerializer
+
+
+class FetchJobSerializer(serializers.ModelSerializer):
+    params = serializers.JSONField(read_only=True)
+    class Meta:
+        model = FetchJob
+        fields = ['id', 'backend', 'params', 'status', 'months_total', 'months_done', 'rows_found', 'error', 'created', 'updated', 'owner', 'heartbeat']
+        read_only_fields = fields
@@ -0,0 +1,37 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Transaction
+from . import rollup
+
+@receiver(pre_save, sender=Transaction)
+def remember_rollup_bucket(sender, instance, raw=False, **kwargs):
+    """
+    Keep the bucket and amount a transaction was counted with before it changes, so it's moved between buckets
+    """
+    instance._old_rollup_count = None
+    instance._rollup_built = not raw and rollup.is_built()
+    if not instance._rollup_built or instance.pk is None:
+        return
+    old = Transaction.objects.filter(pk=instance.pk).only('transaction_date', 'billed_amount', *rollup.DIMENSIONS).first()
+    if old is not None:
+        instance._old_rollup_count = (rollup.bucket(old), old.billed_amount)
+
+@receiver(post_save, sender=Transaction)
+def update_rollup_on_save(sender, instance, raw=False, **kwargs):
+    # The rollup table is only kept up to date once it's built
+    if raw or not getattr(instance, '_rollup_built', False):
+        return
+    new = (rollup.bucket(instance), instance.billed_amount)
+    old = getattr(instance, '_old_rollup_count', None)
+    if old is not None:
+        if old == new:
+            return
+        rollup.remove_from_bucket(*old)
+    rollup.add_to_bucket(*new)
+
+@receiver(post_delete, sender=Transaction)
+def update_rollup_on_delete(sender, instance, **kwargs):
+    if not rollup.is_built():
+        return
+    rollup.remove_from_bucket(rollup.bucket(instance), instance.billed_amount)
@@ -0,0 +1,81 @@
+from django.db.models import F, Sum, Count, Min, Max
+from django.db.models.functions import TruncMonth
+
+from .models import MonthlyRollup
+from . import rollup
+
+# What transactions can be grouped by in a summary
+GROUPS = {
+    'category': F('category__title'),
+    'from_account': F('from_account__name'),
+    'to_account': F('to_account__name'),
+    'currency': F('original_currency'),
+    'month': TruncMonth('transaction_date'),
+    'bill_month': TruncMonth('bill_date'),
+}
+
+AGGREGATES = {
+    'sum': Sum('billed_amount'),
+    'count': Count('id'),
+    'min': Min('billed_amount'),
+    'max': Max('billed_amount'),
+}
+
+# What can be grouped by when reading from the rollup table
+ROLLUP_GROUPS = {
+    'category': F('category__title'),
+    'from_account': F('from_account__name'),
+    'to_account': F('to_account__name'),
+    'currency': F('original_currency'),
+    'month': F('month'),
+}
+
+ROLLUP_AGGREGATES = {
+    'sum': Sum('total'),
+    'count': Sum('count'),
+    'min': Min('min_amount'),
+    'max': Max('max_amount'),
+}
+
+def _group(queryset, groups, group_by, aggregates):
+    if not group_by:
+        return [ queryset.aggregate(**aggregates) ]
+    # Prefix the grouped values, since their names may clash with model fields
+    aliases = { f'group_{name}': groups[name] for name in group_by }
+    rows = queryset.order_by().values(**aliases).annotate(**aggregates).order_by(*aliases)
+    return [ { k.removeprefix('group_'): v for k, v in r.items() } for r in rows ]
+
+def can_use_rollup(group_by, params):
+    """
+    Return whether a summary can be read from the rollup table: it must be grouped by rollup dimensions only,
+    limited by whole months of transaction_date, and the table must be built
+    """
+    if any(g not in ROLLUP_GROUPS for g in group_by):
+        return False
+    if params.get('bill_from') or params.get('bill_to'):
+        return False
+    if not all(params[p].endswith('-01') for p in ['from', 'to'] if params.get(p)):
+        return False
+    return rollup.is_built()
+
+def summarize_rollup(group_by, date_from=None, date_to=None):
+    """
+    Like summarize, reading the monthly rollup table instead of all transactions.
+    date_from and date_to must be first days of months.
+    """
+    queryset = MonthlyRollup.objects.all()
+    if date_from:
+        queryset = queryset.filter(month__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(month__lt=date_to)
+    rows = _group(queryset, ROLLUP_GROUPS, group_by, ROLLUP_AGGREGATES)
+    for r in rows:
+        r['count'] = r['count'] or 0
+    return rows
+
+def summarize(queryset, group_by):
+    """
+    Return the sum, count, min and max of billed_amount of queryset's transactions, for each group of values of
+    the group_by names. Groups are sorted by their values.
+    """
+    return _group(queryset, GROUPS, group_by, AGGREGATES)
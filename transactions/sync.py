@@ -0,0 +1,77 @@
+import hashlib
+
+from django.conf import settings
+
+from .models import AccountSyncState
+from .ingest import _as_date
+
+
+def month_label(month, year):
+    return f'{year:04}-{month:02}'
+
+def _shift_month(month, year, months):
+    index = year * 12 + month - 1 + months
+    return index % 12 + 1, index // 12
+
+def start_month(accounts, month=None, year=None):
+    """
+    Return the (month, year) a since_last_sync fetch of accounts starts from: the month of the oldest last synced
+    transaction, less SYNC_OVERLAP_MONTHS, but not before month and year if they're given.
+    If an account was never synced, return month and year, which are None if they weren't given.
+    """
+    overlap = getattr(settings, 'SYNC_OVERLAP_MONTHS', 1)
+    watermarks = dict(AccountSyncState.objects.filter(account__in=accounts).values_list('account', 'last_transaction_date'))
+    dates = [ watermarks.get(a.pk) for a in accounts ]
+    if not dates or None in dates:
+        return month, year
+    oldest = min(dates)
+    synced_month, synced_year = _shift_month(oldest.month, oldest.year, -overlap)
+    if month is None:
+        return synced_month, synced_year
+    return max((year, month), (synced_year, synced_month))[::-1]
+
+def content_hash(transactions):
+    """
+    Return a hash of the fields the backends fetch, that doesn't depend on the order of the transactions
+    """
+    rows = sorted(repr((str(t.transaction_date), str(t.bill_date), t.from_account_id, t.to_account_id,
+                        str(t.transaction_amount), str(t.billed_amount), t.original_currency, t.description, t.notes))
+                  for t in transactions)
+    return hashlib.sha256('\n'.join(rows).encode()).hexdigest()
+
+
+class SyncTracker:
+    """
+    Follow the months fetched for a set of accounts, and tell which of them changed since they were last synced
+    """
+    def __init__(self, accounts):
+        existing = { s.account_id: s for s in AccountSyncState.objects.filter(account__in=accounts) }
+        self.states = { a.pk: existing.get(a.pk) or AccountSyncState(account=a) for a in accounts }
+
+    def _own(self, account, transactions):
+        return [ t for t in transactions if account.pk in (t.from_account_id, t.to_account_id) ]
+
+    def changed(self, accounts, month, year, transactions):
+        """
+        Return whether the transactions fetched for a month of accounts differ from what was recorded for it
+        """
+        label = month_label(month, year)
+        return any(self.states[a.pk].month_hashes.get(label) != content_hash(self._own(a, transactions)) for a in accounts)
+
+    def record(self, accounts, month, year, transactions):
+        """
+        Record the transactions of a month of accounts as stored
+        """
+        label = month_label(month, year)
+        for account in accounts:
+            own = self._own(account, transactions)
+            state = self.states[account.pk]
+            state.month_hashes[label] = content_hash(own)
+            transaction_dates = [ _as_date(t.transaction_date) for t in own if t.transaction_date ] + [ state.last_transaction_date ]
+            bill_dates = [ _as_date(t.bill_date) for t in own if t.bill_date ] + [ state.last_bill_date ]
+            state.last_transaction_date = max(filter(None, transaction_dates), default=None)
+            state.last_bill_date = max(filter(None, bill_dates), default=None)
+
+    def save(self):
+        for state in self.states.values():
+            state.save()
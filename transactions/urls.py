@@ -8,6 +8,7 @@ router.register('accounts', views.AccountViewSet)
 router.register('transactions', views.TransactionViewSet)
 router.register('categories', views.CategoryViewSet)
 router.register('pattern', views.PatternViewSet)
+router.register('fetch_jobs', views.FetchJobViewSet)
 
 urlpatterns = [
     path('fetch/<slug:backend>', views.fetch_view),
@@ -42,10 +42,47 @@ AUTH_SOURCE_SCHEMAS = {
             "cmd": {
                 "type": "string",
             },
+            "cache_ttl": {
+                "type": "integer",
+                "minimum": 0,
+            },
         },
         "required": [],
         "additionalProperties": False,
-    }
+    },
+    'bitwarden_serve': {
+        "$id": "https://localhost:8000/bitwarden_serve_settings.schema.json",
+        "$schema": "https://json-schema.org/draft/2020-12/schema",
+        "title": "Bitwarden serve auth source settings",
+        "description": "Settings for bitwarden auth sources that use a long running bw serve",
+        "type": "object",
+        "properties": {
+            "path": {
+                "type": "string",
+            },
+            "cmd": {
+                "type": "string",
+            },
+            "cache_ttl": {
+                "type": "integer",
+                "minimum": 0,
+            },
+            "port": {
+                "type": "integer",
+                "minimum": 1,
+                "maximum": 65535,
+            },
+            "start": {
+                "type": "boolean",
+            },
+            "timeout": {
+                "type": "number",
+                "exclusiveMinimum": 0,
+            },
+        },
+        "required": [],
+        "additionalProperties": False,
+    },
 }
 
 for k, v in itertools.chain(ACCOUNT_SCHEMAS.items(), AUTH_SOURCE_SCHEMAS.items()):
@@ -1,14 +1,55 @@
 import datetime
-import itertools
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, pagination, mixins
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import api_view, action
-from .models import AuthSource, Account, Transaction, Category, Pattern
-from .serializers import AccountSerializer, AuthSourceSerializer, TransactionSerializer, CategorySerializer, PatternSerializer
-
-import fetchers
-import auth_sources
-from .auto_category import categorize
+from .models import AuthSource, Account, Transaction, Category, Pattern, FetchJob
+from .serializers import AccountSerializer, AuthSourceSerializer, TransactionSerializer, CategorySerializer, PatternSerializer, FetchJobSerializer
+
+from .fetch import FetchRequest, FetchError, parse_bool
+from . import fetch
+from . import jobs
+from .recategorize import recategorize, enabled_rules
+from . import summary
+
+
+def date_range(year, month=None, day=None):
+    """
+    Return the half-open range [start, end) of dates of a year, a month or a day
+    """
+    if not datetime.MINYEAR <= year < datetime.MAXYEAR:
+        raise ValueError(f"year must be between {datetime.MINYEAR} and {datetime.MAXYEAR - 1}")
+    if day is not None:
+        start = datetime.date(year, month, day)
+        return start, start + datetime.timedelta(days=1)
+    if month is not None:
+        start = datetime.date(year, month, 1)
+        return start, datetime.date(year + month // 12, month % 12 + 1, 1)
+    return datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+
+DATE_RANGE_PARAMS = {
+    'from': 'transaction_date__gte',
+    'to': 'transaction_date__lt',
+    'bill_from': 'bill_date__gte',
+    'bill_to': 'bill_date__lt',
+}
+
+def filter_date_range(queryset, params):
+    """
+    Filter queryset by the 'from' (inclusive) and 'to' (exclusive) dates in params, on transaction_date, and by
+    'bill_from' and 'bill_to' on bill_date
+    """
+    filters = {}
+    for param, lookup in DATE_RANGE_PARAMS.items():
+        if not params.get(param):
+            continue
+        try:
+            filters[lookup] = datetime.date.fromisoformat(params[param])
+        except (TypeError, ValueError):
+            raise ValueError(f"'{param}' must be a date in YYYY-MM-DD format")
+    return queryset.filter(**filters)
 
 
 class AuthSourceViewSet(viewsets.ModelViewSet):
@@ -31,25 +72,62 @@ class PatternViewSet(viewsets.ModelViewSet):
     serializer_class = PatternSerializer
 
 
+class TransactionCursorPagination(pagination.CursorPagination):
+    ordering = ('transaction_date', 'id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
 class TransactionViewSet(viewsets.ModelViewSet):
     serializer_class = TransactionSerializer
-    queryset = Transaction.objects.all()
+    queryset = Transaction.objects.select_related('from_account', 'to_account', 'category')
+    pagination_class = TransactionCursorPagination
 
     def get_queryset(self):
         queryset = self.queryset
-        if 'year' in self.kwargs:
-            queryset = queryset.filter(transaction_date__year=self.kwargs['year'])
-        if 'month' in self.kwargs:
-            queryset = queryset.filter(transaction_date__month=self.kwargs['month'])
-        if 'day' in self.kwargs:
-            queryset = queryset.filter(transaction_date__day=self.kwargs['day'])
+        try:
+            if self.kwargs.get('year'):
+                date_parts = [ int(self.kwargs[k]) if self.kwargs.get(k) else None for k in ['year', 'month', 'day'] ]
+                start, end = date_range(*date_parts)
+                queryset = queryset.filter(transaction_date__gte=start, transaction_date__lt=end)
+            queryset = filter_date_range(queryset, self.request.query_params)
+        except (ValueError, OverflowError) as e:
+            raise ValidationError(str(e))
 
         return queryset.all()
 
-    @action(detail=False, url_path='by_date/(?P<year>[0-9]+)(/(?P<month>[0-9]+)(/(?P<day>[0-9]))?)?')
+    @action(detail=False, url_path='by_date/(?P<year>[0-9]+)(/(?P<month>[0-9]+)(/(?P<day>[0-9]+))?)?')
     def list_by_date(self, request, *args, **kwargs):
         return self.list(request)
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['bulk'] = parse_bool(self.request.query_params.get('bulk', False))
+        return context
+
+    @action(detail=False)
+    def summary(self, request, *args, **kwargs):
+        group_by = [ g for g in request.query_params.get('group_by', '').split(',') if g ]
+        unknown = [ g for g in group_by if g not in summary.GROUPS ]
+        if unknown:
+            return Response(f"Can't group by: {', '.join(unknown)}", status=400)
+        queryset = self.get_queryset()
+        if summary.can_use_rollup(group_by, request.query_params):
+            params = request.query_params
+            return Response(summary.summarize_rollup(group_by, params.get('from'), params.get('to')))
+        return Response(summary.summarize(queryset, group_by))
+
+    @action(detail=False, methods=['post'])
+    def recategorize(self, request, *args, **kwargs):
+        try:
+            queryset = filter_date_range(Transaction.objects.all(), request.data)
+        except ValueError as e:
+            return Response(str(e), status=400)
+        only_uncategorized = parse_bool(request.data.get('only_uncategorized', False))
+        updated = recategorize(queryset, enabled_rules(), only_uncategorized)
+        return Response(dict(message="ok", updated=updated))
+
     def create(self, request, *args, **kwargs):
         bulk_data = request.data if isinstance(request.data, list) else [request.data]
         serializer = self.get_serializer(data=bulk_data, many=True)
@@ -67,58 +145,74 @@ class TransactionViewSet(viewsets.ModelViewSet):
                 message="ok"
             return Response(dict(message=message, written=written, errors=errors), status=status.HTTP_201_CREATED)
         else:
-            errors = { i: e for i, e in enumerate(serializer.errors) if e }
+            errors = serializer.errors
+            if isinstance(errors, list):
+                errors = dict(enumerate(errors))
+            errors = { i: e for i, e in errors.items() if e }
             return Response(dict(message="failed_validation", errors=errors), status=status.HTTP_400_BAD_REQUEST)
 
-def loop_months(month, year, end_month, end_year):
-    if (not 1 <= month <= 12) or (not 1 <= end_month <= 12) or year <= 0 or end_year <= 0:
-        raise ValueError("months must be between 1 and 12, years must be positive")
-    while year < end_year or (year == end_year and month <= end_month):
-        yield month, year
-        month += 1
-        if month == 13:
-            month = 1
-            year += 1
+def _ndjson_months(fetch_request, groups):
+    """
+    Yield a line of JSON for every month of every group of a fetch, as soon as it's fetched.
+    Errors after the response started are sent as a last line with an 'error' key.
+    """
+    renderer = JSONRenderer()
+    try:
+        for group_idx, month_idx, transactions in fetch_request.iter_months(groups):
+            month, year = fetch_request.months[month_idx]
+            accounts = [ a.name for a in groups[group_idx][1] ]
+            serialized_transactions = [ t.to_dict() for t in transactions ]
+            yield renderer.render(dict(accounts=accounts, month=month, year=year, transactions=serialized_transactions)) + b'\n'
+    except FetchError as e:
+        yield renderer.render(dict(error=e.message)) + b'\n'
 
 @api_view(http_method_names=['POST'])
 def fetch_view(request, backend):
+    """
+    Fetch a backend's transactions. With 'stream' set, respond with newline delimited JSON, a line per month and
+    group of accounts, sent as soon as each is fetched. With 'store' set, write the new transactions and respond
+    with counts and their ids instead of the transactions. With 'since_last_sync' set, start from the last
+    stored transaction of the accounts instead of the requested month, if that's later.
+    """
+    stream = parse_bool(request.data.get('stream', False))
+    store = parse_bool(request.data.get('store', False))
+    if stream and store:
+        return Response("stream and store can't be used together", status=status.HTTP_400_BAD_REQUEST)
     try:
-        backend_obj = fetchers.get_backend(backend)
-    except KeyError:
-        return Response(f'Unknown backend: {backend}', status=404)
-    try:
-        auth_source_obj = AuthSource.objects.all()[0]
-        auth_source = auth_sources.get_backend(auth_source_obj.auth_type)(**auth_source_obj.settings)
-    except KeyError:
-        return Response(f'Unknown auth source: {auth_source_obj.auth_type}', status=404)
-    try:
-        passwd = request.data["pass"]
-        month = int(request.data.get("month", datetime.date.today().month))
-        year = int(request.data.get("year", datetime.date.today().year))
-        end_month = int(request.data.get('end_month', month))
-        end_year = int(request.data.get("end_year", year))
-        get_item_id = lambda a: a.auth_source_item_id
-        accounts_by_auth_source = itertools.groupby(sorted(Account.objects.filter(backend_type=backend), key=get_item_id), key=get_item_id)
-        auto_category_rules = list(Pattern.objects.all())
-    except KeyError as e:
-        return Response("'pass' param is required", status=400)
-    except ValueError:
-        return Response("'month' and 'year' must be integers", status=400)
-    except Exception as e:
-        return Response(f'Error: {e}', status=500)
-    try:
-        with auth_source.unlock(passwd):
-            transactions = []
-            for item_id, accounts in accounts_by_auth_source:
-                authinfo = auth_source.get_auth_info(item_id)
-                s = backend_obj.login(authinfo['username'], authinfo['password'])
-                transactions_per_month = [ backend_obj.get_month_transactions(s, m, y, list(accounts)) for m, y in loop_months(month, year, end_month, end_year)]
-                transactions += list(itertools.chain.from_iterable(transactions_per_month))
-    except fetchers.FetchException as e:
-        return Response(str(e), status=400)
-    except auth_sources.AuthError as e:
-        return Response(str(e), status=400)
-    for t in transactions:
-        t.category = categorize(auto_category_rules, t)
-    serialized_transactions = [ TransactionSerializer(t).data for t in transactions ]
+        fetch_request = FetchRequest(backend, request.data)
+        if store:
+            return Response(fetch.store(fetch_request))
+        if stream:
+            groups = fetch_request.get_groups()
+            return StreamingHttpResponse(_ndjson_months(fetch_request, groups), content_type='application/x-ndjson')
+        transactions = fetch_request.run()
+    except FetchError as e:
+        return Response(e.message, status=e.status)
+    serialized_transactions = [ t.to_dict() for t in transactions ]
     return Response(serialized_transactions)
+
+
+class FetchJobViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Fetches that run in the background. Create one with the parameters of fetch_view and a 'backend', then poll it
+    for progress and get its transactions from its result once its status is done.
+    """
+    serializer_class = FetchJobSerializer
+    queryset = FetchJob.objects.order_by('-id')
+
+    def create(self, request, *args, **kwargs):
+        backend = request.data.get('backend')
+        if not backend:
+            return Response("'backend' param is required", status=400)
+        try:
+            job = jobs.submit(backend, request.data)
+        except FetchError as e:
+            return Response(e.message, status=e.status)
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True)
+    def result(self, request, *args, **kwargs):
+        job = self.get_object()
+        if job.status != FetchJob.DONE:
+            return Response(self.get_serializer(job).data, status=status.HTTP_409_CONFLICT)
+        return Response(job.result)